@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: HTML extraction throughput and output parity across parser backends.
+
+Runs every parser over a fixed directory of saved HTML pages, inline and on the
+ContentExtractor process pool, and compares the extracted text against the
+original html.parser output.
+
+Usage (from the backend directory):
+    python bench_extract.py --save            # snapshot the crawler's curated URLs once
+    python bench_extract.py --workers 4 --repeat 5
+"""
+
+import argparse
+import difflib
+import os
+import time
+
+from content_extractor import ContentExtractor, PARSERS, extract_text, resolve_parser
+
+DEFAULT_PAGES_DIR = os.path.join(os.path.dirname(__file__), "bench_pages")
+
+
+def save_pages(pages_dir: str):
+    """Fetch the curated crawl URLs into pages_dir so later runs use a fixed set."""
+    from smart_crawler import SmartCrawler
+
+    os.makedirs(pages_dir, exist_ok=True)
+    crawler = SmartCrawler(rag_system=None)
+    topics = ["artificial intelligence", "machine learning", "cloud computing", "python programming", "climate change"]
+    for topic in topics:
+        for url in crawler.get_search_urls(topic, num_results=3):
+            fetched = crawler.fetch_page(url)
+            if fetched is None:
+                continue
+            html, _ = fetched
+            name = url.split("://", 1)[1].strip("/").replace("/", "_") + ".html"
+            with open(os.path.join(pages_dir, name), "wb") as f:
+                f.write(html)
+            print(f"💾 {url} -> {name} ({len(html) / 1024:.0f} KB)")
+    crawler.extractor.shutdown()
+
+
+def load_pages(pages_dir: str):
+    pages = []
+    for name in sorted(os.listdir(pages_dir)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(pages_dir, name), "rb") as f:
+                pages.append((name, f.read()))
+    return pages
+
+
+def similarity(a: str, b: str) -> float:
+    # Compare the stored prefix only; that is what ends up in the knowledge base
+    return difflib.SequenceMatcher(None, a[:3000], b[:3000], autojunk=False).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HTML extraction backends on throughput and parity.")
+    parser.add_argument("--pages", default=DEFAULT_PAGES_DIR, help="Directory of saved .html pages")
+    parser.add_argument("--save", action="store_true", help="Fetch the curated crawl URLs into --pages and exit")
+    parser.add_argument("--parsers", default=",".join(PARSERS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the page set per measurement")
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.pages)
+        return
+
+    pages = load_pages(args.pages) if os.path.isdir(args.pages) else []
+    if not pages:
+        print(f"❌ No saved pages in {args.pages}. Run with --save first.")
+        return
+    total_mb = sum(len(html) for _, html in pages) * args.repeat / (1024 * 1024)
+    print(f"📊 {len(pages)} pages, {total_mb / args.repeat:.1f} MB per pass, {args.repeat} passes, {args.workers} workers")
+
+    reference = {name: extract_text(html, "html.parser") for name, html in pages}
+
+    print(f"{'parser':<12} {'inline p/s':>11} {'pool p/s':>9} {'MB/s':>7} {'exact':>7} {'similarity':>11}")
+    for name in [p.strip() for p in args.parsers.split(",") if p.strip()]:
+        parser_name = resolve_parser(name)
+
+        start = time.perf_counter()
+        outputs = {}
+        for _ in range(args.repeat):
+            for page_name, html in pages:
+                outputs[page_name] = extract_text(html, parser_name)
+        inline_seconds = time.perf_counter() - start
+
+        extractor = ContentExtractor(parser=parser_name, workers=args.workers)
+        extractor.extract(pages[0][1])  # start the pool outside the timed region
+        start = time.perf_counter()
+        futures = [extractor.submit(html) for _ in range(args.repeat) for _, html in pages]
+        for future in futures:
+            future.result()
+        pool_seconds = time.perf_counter() - start
+        extractor.shutdown()
+
+        exact = sum(outputs[n] == reference[n] for n, _ in pages) / len(pages)
+        mean_similarity = sum(similarity(outputs[n][1], reference[n][1]) for n, _ in pages) / len(pages)
+        n_docs = len(pages) * args.repeat
+        print(f"{name:<12} {n_docs / inline_seconds:>11.1f} {n_docs / pool_seconds:>9.1f} "
+              f"{total_mb / pool_seconds:>7.1f} {exact:>7.0%} {mean_similarity:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
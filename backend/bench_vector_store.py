@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: query latency and resident memory of the vector store backends.
+
+Each backend ingests into a fresh temporary directory in one process; queries and
+RSS are then measured in a second, fresh process that only opens the store, so the
+numbers reflect a serving worker rather than the ingest (or a cached client). Random unit vectors stand in
+for real embeddings (384 dims, matching all-MiniLM-L6-v2).
+
+Usage (from the backend directory):
+    python bench_vector_store.py --docs 50000 --queries 200
+    python bench_vector_store.py --backends mmap --ivf-lists 256
+"""
+
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import ChromaVectorStore, MmapVectorStore
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux /proc, falling back to peak RSS)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_store(backend: str, path: str, args):
+    if backend == "chroma":
+        return ChromaVectorStore(path, collection_name="bench")
+    return MmapVectorStore(path, dtype=args.dtype, ivf_nprobe=args.nprobe)
+
+
+def run_ingest(backend: str, path: str, args, queue):
+    rng = np.random.default_rng(42)
+    store = make_store(backend, path, args)
+
+    start = time.perf_counter()
+    for offset in range(0, args.docs, args.batch):
+        n = min(args.batch, args.docs - offset)
+        vectors = rng.standard_normal((n, args.dim)).astype(np.float32)
+        store.add(
+            ids=[f"doc-{offset + i}" for i in range(n)],
+            embeddings=vectors,
+            documents=[f"document body {offset + i}" for i in range(n)],
+            metadatas=[{"title": f"Doc {offset + i}", "url": f"https://example.com/{offset + i}"} for i in range(n)]
+        )
+    if backend == "mmap" and args.ivf_lists:
+        store.build_ivf(n_lists=args.ivf_lists)
+    store.close()
+    queue.put(time.perf_counter() - start)
+
+
+def run_queries(backend: str, path: str, args, queue):
+    rng = np.random.default_rng(7)
+    baseline_rss = rss_mb()
+    store = make_store(backend, path, args)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    for q in queries[:5]:
+        store.query(q.reshape(1, -1), n_results=args.k)  # warm-up
+
+    latencies = []
+    for q in queries:
+        t0 = time.perf_counter()
+        store.query(q.reshape(1, -1), n_results=args.k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    latencies = np.array(latencies)
+    queue.put({
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "qps": 1000 / float(latencies.mean()),
+        "rss_mb": rss_mb() - baseline_rss
+    })
+
+
+def in_fresh_process(target, *args):
+    """Runs target(*args, queue) in a new process and returns what it put on the queue."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(*args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector store backends on query latency and RSS.")
+    parser.add_argument("--backends", default="chroma,mmap", help="Comma-separated list: chroma,mmap")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--ivf-lists", type=int, default=0, help="Build an IVF index for the mmap backend (0 = exact)")
+    parser.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"📊 {args.docs} docs x {args.dim} dims, {args.queries} queries, k={args.k}")
+    print(f"{'backend':<8} {'ingest s':>9} {'p50 ms':>8} {'p95 ms':>8} {'qps':>8} {'RSS MB':>8}")
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        with tempfile.TemporaryDirectory() as tmp:
+            ingest_seconds = in_fresh_process(run_ingest, backend, tmp, args)
+            result = in_fresh_process(run_queries, backend, tmp, args)
+        print(f"{backend:<8} {ingest_seconds:>9.2f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['qps']:>8.0f} {result['rss_mb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
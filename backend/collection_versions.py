@@ -0,0 +1,255 @@
+# backend/collection_versions.py - Versioned collections and background re-embedding into a shadow collection
+import os
+import re
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_COLLECTION = 'documents'
+
+
+class ActiveIndex:
+    """An embedding model paired with the collection it was used to build."""
+
+    def __init__(self, model_name: str, model, collection: str, store):
+        self.model_name = model_name
+        self.model = model
+        self.collection = collection
+        self.store = store
+
+
+class CollectionRegistry:
+    """
+    Small JSON file recording which collection (and embedding model) is active,
+    which one is being built as a shadow, and which are retired awaiting GC.
+    Every write replaces the file atomically so readers never see a partial state.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Trees created before versioning used a fixed model and collection name
+            return {
+                "version": 0,
+                "active": {"model": DEFAULT_MODEL, "collection": DEFAULT_COLLECTION},
+                "shadow": None,
+                "retired": []
+            }
+
+    def save(self, state: Dict[str, Any]):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def update(self, mutate) -> Dict[str, Any]:
+        """Applies mutate(state) under a lock and persists the result."""
+        with self._lock:
+            state = self.load()
+            mutate(state)
+            self.save(state)
+            return state
+
+    def mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+
+def versioned_collection_name(version: int, model_name: str) -> str:
+    # Chroma names: 3-63 chars of [a-zA-Z0-9_-], starting and ending alphanumeric
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', model_name.split('/')[-1]).strip('-')[:40] or "model"
+    return f"{DEFAULT_COLLECTION}-v{version}-{slug}"
+
+
+class ShadowMigrator:
+    """
+    Re-embeds the active collection with a new model into a shadow collection.
+
+    The build runs on a background thread in small batches, sleeping `pause_seconds`
+    between batches and waiting while live searches are in flight, so serving latency
+    is not affected. Documents ingested during the build are mirrored into the shadow.
+    With `dual_read_rate` > 0 a sample of live queries is also run against the shadow
+    on a single worker thread and the top-k overlap is recorded; samples arriving while
+    that worker is busy are dropped rather than queued. switch() swaps the active index atomically; the
+    old collection is kept as retired until gc().
+    """
+
+    def __init__(self, rag_system, model_name: str, batch_size: int = 32,
+                 pause_seconds: float = 0.2, dual_read_rate: float = 0.0):
+        self.rag_system = rag_system
+        self.registry: CollectionRegistry = rag_system.registry
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.dual_read_rate = dual_read_rate
+        self.status = "pending"
+        self.error = None
+        self.processed = 0
+        self.total = 0
+        self.overlaps = deque(maxlen=500)
+        self.shadow: Optional[ActiveIndex] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # The build thread and mirror() (crawler thread) must not both add the same ids
+        self._copy_lock = threading.Lock()
+        self._dual_reads: "queue.Queue" = queue.Queue(maxsize=8)
+        self._dual_read_thread: Optional[threading.Thread] = None
+
+    # --- Build ---
+
+    def start(self):
+        state = self.registry.load()
+        if state.get("shadow"):
+            # Resume a build interrupted by a restart; existing rows are skipped
+            if state["shadow"]["model"] != self.model_name:
+                raise ValueError(f"A shadow build for {state['shadow']['model']} is already in progress.")
+            collection = state["shadow"]["collection"]
+        else:
+            def add_shadow(s):
+                s["version"] = s.get("version", 0) + 1
+                s["shadow"] = {"model": self.model_name,
+                               "collection": versioned_collection_name(s["version"], self.model_name),
+                               "status": "building"}
+            collection = self.registry.update(add_shadow)["shadow"]["collection"]
+
+        self.shadow = self.rag_system.open_index(self.model_name, collection)
+        self.status = "building"
+        self._thread = threading.Thread(target=self._run, name="shadow-reembed", daemon=True)
+        self._thread.start()
+        logger.info(f"Started shadow re-embedding into '{collection}' with model {self.model_name}")
+
+    def _run(self):
+        source = self.rag_system.active
+        try:
+            self.total = source.store.count()
+            for ids, documents, metadatas in source.store.iter_documents(batch_size=self.batch_size):
+                if self._stop.is_set():
+                    return
+                self._wait_for_idle()
+                self._copy(ids, documents, metadatas)
+                self.processed += len(ids)
+                time.sleep(self.pause_seconds)
+
+            self.status = "ready"
+            self.registry.update(lambda s: s["shadow"] and s["shadow"].update(status="ready"))
+            logger.info(f"Shadow collection '{self.shadow.collection}' ready ({self.processed} documents)")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Shadow re-embedding failed: {e}")
+
+    def _wait_for_idle(self):
+        """Yields to live traffic: no shadow work while searches are in flight."""
+        while self.rag_system.in_flight > 0 and not self._stop.is_set():
+            time.sleep(0.05)
+
+    def _copy(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        with self._copy_lock:
+            existing = self.shadow.store.existing_ids(ids)
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            if not keep:
+                return
+            texts = [documents[i] for i in keep]
+            self.shadow.store.add(
+                ids=[ids[i] for i in keep],
+                embeddings=self.rag_system.embed_documents(texts, index=self.shadow),
+                documents=texts,
+                metadatas=[metadatas[i] for i in keep]
+            )
+
+    def mirror(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Called by store_documents so documents ingested mid-build reach the shadow too."""
+        if self.status in ("building", "ready"):
+            try:
+                self._copy(ids, documents, metadatas)
+            except Exception as e:
+                logger.warning(f"Could not mirror documents into shadow collection: {e}")
+
+    # --- Dual read ---
+
+    def maybe_dual_read(self, queries: List[str], active_hits: List[List[Dict[str, Any]]], n_results: int):
+        """Samples live queries for comparison of active vs shadow top-k in the background."""
+        if self.dual_read_rate <= 0 or self.status != "ready" or random.random() >= self.dual_read_rate:
+            return
+        if self._dual_read_thread is None:
+            self._dual_read_thread = threading.Thread(target=self._dual_read_loop, name="shadow-dual-read",
+                                                      daemon=True)
+            self._dual_read_thread.start()
+        try:
+            self._dual_reads.put_nowait((queries, active_hits, n_results))
+        except queue.Full:
+            pass  # under load the comparison is skipped, never the serving path
+
+    def _dual_read_loop(self):
+        while not self._stop.is_set():
+            try:
+                queries, active_hits, n_results = self._dual_reads.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                shadow_hits = self.shadow.store.query(self.shadow.model.encode(queries), n_results=n_results)
+                for active, shadow in zip(active_hits, shadow_hits):
+                    active_ids = {h["id"] for h in active}
+                    if active_ids:
+                        self.overlaps.append(len(active_ids & {h["id"] for h in shadow}) / len(active_ids))
+            except Exception as e:
+                logger.warning(f"Dual-read comparison failed: {e}")
+
+    # --- Switch / abort ---
+
+    def switch(self) -> ActiveIndex:
+        if self.status != "ready":
+            raise ValueError(f"Shadow collection is not ready (status: {self.status}).")
+        previous = self.rag_system.active
+        self.rag_system.active = self.shadow  # single reference swap: requests see old or new, never a mix
+
+        def promote(s):
+            s["retired"].append(s["active"])
+            s["active"] = {"model": self.shadow.model_name, "collection": self.shadow.collection}
+            s["shadow"] = None
+        self.registry.update(promote)
+        self.status = "switched"
+        self._stop.set()  # the build is done; this stops the dual-read worker
+        previous.store.close()
+        logger.info(f"Switched active collection from '{previous.collection}' to '{self.shadow.collection}'")
+        return previous
+
+    def abort(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        if self.shadow is not None and self.status != "switched":
+            try:
+                self.shadow.store.drop()
+            finally:
+                self.shadow.store.close()
+            self.registry.update(lambda s: s.update(shadow=None))
+        self.status = "aborted"
+
+    def status_dict(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "collection": self.shadow.collection if self.shadow else None,
+            "status": self.status,
+            "processed": self.processed,
+            "total": self.total,
+            "error": self.error,
+            "dual_read_samples": len(self.overlaps),
+            "mean_top_k_overlap": round(sum(self.overlaps) / len(self.overlaps), 3) if self.overlaps else None
+        }
@@ -0,0 +1,252 @@
+# backend/content_extractor.py - HTML -> (title, text, links) extraction stage used by SmartCrawler
+import os
+import re
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Tuple, Optional, List
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml
+    from lxml import etree
+except ImportError:  # lxml is optional; fall back to the pure-Python parser
+    lxml = None
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+# Elements stripped before extraction (navigation, scripts, page chrome)
+BOILERPLATE_TAGS = ['script', 'style', 'nav', 'header', 'footer', 'aside']
+BOILERPLATE = frozenset(BOILERPLATE_TAGS)
+# Inert markup: BeautifulSoup keeps its strings as TemplateString, which get_text()
+# skips everywhere except when called on the <template> element itself
+INERT_TAGS = frozenset(['template'])
+# Content containers in priority order; the first one yielding > 100 chars wins
+CONTENT_SELECTORS = ['article', 'main', '.content', '[role="main"]', 'section', 'div.post']
+MIN_SELECTOR_CHARS = 100
+
+PARSERS = ('lxml', 'bs4-lxml', 'html.parser')
+
+
+def _normalize_whitespace(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def _extract_bs4(html: bytes, features: str) -> Tuple[str, str, List[str]]:
+    """Original BeautifulSoup extractor, kept for parity checks and as a fallback."""
+    soup = BeautifulSoup(html, features)
+    links = [a['href'] for a in soup.find_all('a', href=True)]
+
+    # Remove unwanted elements
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+
+    title_tag = soup.find('title')
+    title = title_tag.get_text().strip() if title_tag else "Unknown Title"
+
+    content = ""
+    for selector in CONTENT_SELECTORS:
+        elements = soup.select(selector)
+        if elements:
+            content = ' '.join([elem.get_text().strip() for elem in elements])
+            if len(content) > MIN_SELECTOR_CHARS:
+                break
+
+    # Fallback: get all paragraph text
+    if len(content) < MIN_SELECTOR_CHARS:
+        paragraphs = soup.find_all('p')
+        content = ' '.join([p.get_text().strip() for p in paragraphs])
+
+    # Final fallback: body text
+    if len(content) < MIN_SELECTOR_CHARS:
+        body = soup.find('body')
+        if body:
+            content = body.get_text(separator=' ', strip=True)
+
+    content = re.sub(r'\s+', ' ', content).strip()
+    return title, content, links
+
+
+def _selector_matches(element) -> Tuple[int, ...]:
+    """Indices into CONTENT_SELECTORS that this element matches."""
+    tag = element.tag
+    classes = (element.get('class') or '').split()
+    matches = []
+    if tag == 'article':
+        matches.append(0)
+    if tag == 'main':
+        matches.append(1)
+    if 'content' in classes:
+        matches.append(2)
+    if element.get('role') == 'main':
+        matches.append(3)
+    if tag == 'section':
+        matches.append(4)
+    if tag == 'div' and 'post' in classes:
+        matches.append(5)
+    return tuple(matches)
+
+
+def _extract_lxml(html: bytes) -> Tuple[str, str, List[str]]:
+    """
+    Single-pass extractor on an lxml tree. One walk collects text for every
+    content selector, the paragraph fallback and the body fallback at the same
+    time, skipping boilerplate subtrees (but not their tails). Output matches
+    _extract_bs4: each matched element (nested ones included) contributes its own
+    stripped text, and body text is joined with single spaces.
+    """
+    # Incremental (feed) parsing, as BeautifulSoup's lxml builder does: libxml2's
+    # one-shot parser ends a <script> early at a nested <noscript>
+    parser = etree.HTMLParser()
+    try:
+        parser.feed(html)
+        tree = parser.close()
+    except (etree.LxmlError, ValueError):
+        tree = None
+    if tree is None:
+        return "Unknown Title", "", []
+
+    title_text = tree.findtext('.//title')
+    title = title_text.strip() if title_text else "Unknown Title"
+    # Links include boilerplate: navigation is where most of them live
+    links = [str(href) for href in tree.xpath('//a/@href')]
+
+    # One slot per content selector plus a final one for <p>; each slot collects
+    # a text buffer per matched element, in document order
+    paragraph_slot = len(CONTENT_SELECTORS)
+    matched = [[] for _ in range(paragraph_slot + 1)]
+    open_buffers = []  # buffers of every matched element we are currently inside
+    inert_buffers = []  # the subset opened by <template> elements, which keep inert text
+    body_parts = []
+    body_depth = inert_depth = 0
+    stack = []
+
+    def emit(text):
+        if not text:
+            return
+        if inert_depth:
+            for buffer in inert_buffers:
+                buffer.append(text)
+            return
+        for buffer in open_buffers:
+            buffer.append(text)
+        if body_depth:
+            body_parts.append(' ')
+            body_parts.append(text)
+
+    walker = etree.iterwalk(tree, events=('start', 'end', 'comment', 'pi'))
+    for event, element in walker:
+        if event == 'start':
+            if element.tag in BOILERPLATE:
+                walker.skip_subtree()
+                stack.append(0)
+                continue
+            slots = _selector_matches(element)
+            if element.tag == 'p':
+                slots += (paragraph_slot,)
+            buffers = []
+            for slot in slots:
+                buffer = []
+                matched[slot].append(buffer)
+                buffers.append(buffer)
+            open_buffers.extend(buffers)
+            stack.append(len(buffers))
+            if element.tag == 'body':
+                body_depth += 1
+            elif element.tag in INERT_TAGS:
+                # Walked (not skipped) so elements inside still count as selector matches
+                inert_depth += 1
+                inert_buffers.extend(buffers)
+            emit(element.text)
+        elif event == 'end':
+            opened = stack.pop()
+            if opened:
+                del open_buffers[-opened:]
+            if element.tag == 'body':
+                body_depth -= 1
+            elif element.tag in INERT_TAGS:
+                inert_depth -= 1
+                if opened:
+                    del inert_buffers[-opened:]
+            emit(element.tail)
+        else:
+            # Comments and processing instructions carry no text of their own,
+            # but the text following them belongs to the parent
+            emit(element.tail)
+
+    def joined(slot: int) -> str:
+        return ' '.join(''.join(buffer).strip() for buffer in matched[slot])
+
+    content = ""
+    for i in range(len(CONTENT_SELECTORS)):
+        if matched[i]:
+            content = joined(i)
+            if len(content) > MIN_SELECTOR_CHARS:
+                break
+    if len(content) < MIN_SELECTOR_CHARS:
+        content = joined(paragraph_slot)
+    if len(content) < MIN_SELECTOR_CHARS:
+        content = ''.join(body_parts)
+    return title, _normalize_whitespace(content), links
+
+
+def resolve_parser(parser: str) -> str:
+    """Validates a parser name, falling back to html.parser when lxml is unavailable."""
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown HTML parser '{parser}', expected one of {PARSERS}")
+    if parser in ('lxml', 'bs4-lxml') and lxml is None:
+        logger.warning(f"lxml is not installed, using html.parser instead of {parser}")
+        return 'html.parser'
+    return parser
+
+
+def extract_text(html: bytes, parser: str = 'lxml') -> Tuple[str, str, List[str]]:
+    """Returns (title, whitespace-normalised main text, raw link hrefs) for an HTML document."""
+    if parser == 'lxml':
+        return _extract_lxml(html)
+    if parser == 'bs4-lxml':
+        return _extract_bs4(html, 'lxml')
+    return _extract_bs4(html, 'html.parser')
+
+
+class ContentExtractor:
+    """
+    Runs extract_text on a process pool so HTML parsing does not block the fetch
+    thread. EXTRACT_PARSER picks the backend and EXTRACT_WORKERS the pool size
+    (0 runs extraction inline in the calling thread).
+    """
+
+    def __init__(self, parser: str = None, workers: int = None):
+        self.parser = resolve_parser(parser or os.getenv("EXTRACT_PARSER", "lxml"))
+        self.workers = int(os.getenv("EXTRACT_WORKERS", 2)) if workers is None else workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the web process is multi-threaded (scheduler, torch)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def submit(self, html: bytes) -> Future:
+        """Schedules extraction and returns a Future resolving to (title, content, links)."""
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(extract_text(html, self.parser))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._get_pool().submit(extract_text, html, self.parser)
+
+    def extract(self, html: bytes) -> Tuple[str, str, List[str]]:
+        return self.submit(html).result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,359 @@
+# backend/crawl_frontier.py - Persistent crawl frontier, Bloom-filter seen set and robots.txt cache
+import os
+import math
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Iterable, Dict, Any, List
+from urllib.parse import urlparse, urljoin, urldefrag
+from urllib.robotparser import RobotFileParser
+
+logger = logging.getLogger(__name__)
+
+# Links to these are never HTML worth extracting
+SKIPPED_EXTENSIONS = (
+    '.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.css', '.js', '.json', '.xml',
+    '.zip', '.gz', '.tar', '.mp3', '.mp4', '.avi', '.mov', '.woff', '.woff2', '.ttf', '.exe', '.dmg'
+)
+
+
+class BloomFilter:
+    """
+    Fixed-size probabilistic set: memory is decided by (capacity, error_rate) up front
+    and does not grow with the number of URLs added. False positives (a new URL
+    reported as seen) happen at roughly error_rate; false negatives never do.
+    """
+    _HEADER = struct.Struct("<8sQQQ")  # magic, bit count, hash count, items added
+    _MAGIC = b"BLOOM001"
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        # Kirsch-Mitzenmacher double hashing: k positions from two hashes
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item: str) -> bool:
+        """Adds item; returns False if it was (probably) already present."""
+        with self._lock:
+            added = False
+            for p in self._positions(item):
+                mask = 1 << (p & 7)
+                if not self.bits[p >> 3] & mask:
+                    self.bits[p >> 3] |= mask
+                    added = True
+            if added:
+                self.count += 1
+                if self.count == self.capacity:
+                    logger.warning(f"Bloom filter reached its capacity of {self.capacity}; false positives will rise")
+            return added
+
+    def __len__(self) -> int:
+        return self.count
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "wb") as f:
+                f.write(self._HEADER.pack(self._MAGIC, self.num_bits, self.num_hashes, self.count))
+                f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, capacity: int = 1_000_000, error_rate: float = 0.01) -> "BloomFilter":
+        """Loads a saved filter, or returns a new empty one if the file is missing or unreadable."""
+        bloom = cls(capacity, error_rate)
+        try:
+            with open(path, "rb") as f:
+                magic, num_bits, num_hashes, count = cls._HEADER.unpack(f.read(cls._HEADER.size))
+                bits = f.read()
+            if magic != cls._MAGIC or len(bits) != (num_bits + 7) // 8:
+                raise ValueError("corrupt bloom filter file")
+            bloom.num_bits, bloom.num_hashes, bloom.count, bloom.bits = num_bits, num_hashes, count, bytearray(bits)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Could not load bloom filter from {path}: {e}; starting empty")
+        return bloom
+
+
+class RobotsCache:
+    """Fetches robots.txt once per host and keeps the parsed rules in a bounded LRU."""
+
+    def __init__(self, session, user_agent: str = "*", max_hosts: int = 10000, ttl_seconds: float = 24 * 3600):
+        self.session = session
+        self.user_agent = user_agent
+        self.max_hosts = max_hosts
+        self.ttl_seconds = ttl_seconds
+        self._parsers: "OrderedDict[str, Tuple[float, RobotFileParser]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _parser_for(self, url: str) -> RobotFileParser:
+        parsed = urlparse(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            entry = self._parsers.get(host)
+            if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+                self._parsers.move_to_end(host)
+                return entry[1]
+
+        parser = RobotFileParser(host + "/robots.txt")
+        try:
+            response = self.session.get(host + "/robots.txt", timeout=10)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(response.text.splitlines())
+        except Exception as e:
+            # Unreachable robots.txt: treat like a missing one rather than blocking the host
+            logger.info(f"Could not fetch robots.txt for {host}: {e}")
+            parser.allow_all = True
+
+        with self._lock:
+            self._parsers[host] = (time.time(), parser)
+            self._parsers.move_to_end(host)
+            while len(self._parsers) > self.max_hosts:
+                self._parsers.popitem(last=False)
+        return parser
+
+    def allowed(self, url: str) -> bool:
+        return self._parser_for(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> float:
+        delay = self._parser_for(url).crawl_delay(self.user_agent)
+        return float(delay) if delay else 0.0
+
+
+def normalize_url(base_url: str, href: str) -> Optional[str]:
+    """Absolute http(s) URL without fragment, or None for links not worth crawling."""
+    href = (href or "").strip()
+    if not href or href.startswith(("mailto:", "javascript:", "tel:", "#")):
+        return None
+    url, _ = urldefrag(urljoin(base_url, href))
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return None
+    if parsed.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    return url
+
+
+def site_of(url: str) -> str:
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class CrawlFrontier:
+    """
+    Prioritised, persistent queue of URLs to crawl.
+
+    Pending URLs live in SQLite (ordered by priority, then insertion), so the
+    in-process footprint is the two fixed-size Bloom filters regardless of how large
+    the frontier grows. State survives restarts: a paused or interrupted crawl
+    resumes where it stopped on the next run. Lower priority values are crawled
+    first; by default priority is the link depth from a seed URL.
+
+    `domain_budget` caps the pages crawled per domain in one run (start_run() resets
+    it); the rest of that domain's queue waits for the next run. The optional
+    `domain_lifetime_cap` (0 = none) caps pages per domain across all runs, after
+    which the domain's queue is dropped and its links are no longer enqueued.
+    """
+
+    def __init__(self, state_dir: str, max_depth: int = 2, domain_budget: int = 200,
+                 domain_lifetime_cap: int = 0,
+                 bloom_capacity: int = 1_000_000, bloom_error_rate: float = 0.01):
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self.max_depth = max_depth
+        self.domain_budget = domain_budget
+        self.domain_lifetime_cap = domain_lifetime_cap
+        self._run_crawled: Dict[str, int] = {}  # pages per domain in the current run
+        self._run_exhausted = set()  # domains at domain_budget; pop() skips them until start_run()
+        self._seen_path = os.path.join(state_dir, "seen.bloom")
+        self._crawled_path = os.path.join(state_dir, "crawled.bloom")
+        # URLs ever enqueued (dedupes the frontier) and URLs successfully crawled
+        self.seen = BloomFilter.load(self._seen_path, bloom_capacity, bloom_error_rate)
+        self.crawled = BloomFilter.load(self._crawled_path, bloom_capacity, bloom_error_rate)
+        self._paused = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(state_dir, "frontier.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                url TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                priority REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS frontier_priority ON frontier (priority);
+            CREATE TABLE IF NOT EXISTS domains (
+                domain TEXT PRIMARY KEY,
+                crawled INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self._conn.commit()
+        if self._get_state("paused") == "1":
+            self._paused.set()
+
+    # --- Pause / resume ---
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused.is_set()
+
+    def pause(self):
+        """Stops the crawl loop after the current page; persisted across restarts."""
+        self._paused.set()
+        self._set_state("paused", "1")
+
+    def resume(self):
+        self._paused.clear()
+        self._set_state("paused", "0")
+
+    # --- Queue ---
+
+    def start_run(self):
+        """Resets the per-run domain budgets; called at the start of every crawl run."""
+        with self._lock:
+            self._run_crawled.clear()
+            self._run_exhausted.clear()
+
+    def _domain_retired(self, domain: str) -> bool:
+        """True once a domain has used up its lifetime cap (never, without one)."""
+        if not self.domain_lifetime_cap:
+            return False
+        row = self._conn.execute("SELECT crawled FROM domains WHERE domain = ?", (domain,)).fetchone()
+        return row is not None and row[0] >= self.domain_lifetime_cap
+
+    def push(self, url: str, depth: int = 0, priority: float = None) -> bool:
+        """Enqueues url unless already seen, too deep, or its domain reached its lifetime cap."""
+        if depth > self.max_depth or url in self.seen:
+            return False
+        domain = site_of(url)
+        with self._lock:
+            if self._domain_retired(domain):
+                return False
+            self._conn.execute(
+                "INSERT OR IGNORE INTO frontier (url, domain, depth, priority) VALUES (?, ?, ?, ?)",
+                (url, domain, depth, float(depth if priority is None else priority))
+            )
+            self._conn.commit()
+        self.seen.add(url)
+        return True
+
+    def push_many(self, urls: List[str], depth: int = 0, priority: float = None) -> int:
+        """push() for a page's worth of links in one transaction; returns how many were enqueued."""
+        if depth > self.max_depth:
+            return 0
+        fresh = {url: site_of(url) for url in urls if url not in self.seen}
+        if not fresh:
+            return 0
+        priority = float(depth if priority is None else priority)
+        with self._lock:
+            retired = {domain for domain in set(fresh.values()) if self._domain_retired(domain)}
+            rows = [(url, domain, depth, priority) for url, domain in fresh.items() if domain not in retired]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO frontier (url, domain, depth, priority) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+        for url, _, _, _ in rows:
+            self.seen.add(url)
+        return len(rows)
+
+    def push_seed(self, url: str) -> bool:
+        """Seeds bypass the seen filter so curated pages are revisited each run if not yet crawled."""
+        if url in self.crawled:
+            return False
+        domain = site_of(url)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO frontier (url, domain, depth, priority) VALUES (?, ?, 0, -1)",
+                (url, domain)
+            )
+            self._conn.commit()
+        self.seen.add(url)
+        return True
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        """
+        Removes and returns the highest-priority (url, depth) whose domain still has
+        budget this run, or None when there is none.
+        """
+        with self._lock:
+            exhausted = list(self._run_exhausted)
+            where = f"WHERE domain NOT IN ({', '.join('?' * len(exhausted))}) " if exhausted else ""
+            row = self._conn.execute(
+                f"SELECT rowid, url, depth FROM frontier {where}ORDER BY priority, rowid LIMIT 1",
+                exhausted).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM frontier WHERE rowid = ?", (row[0],))
+            self._conn.commit()
+            return row[1], row[2]
+
+    def record_crawl(self, url: str):
+        """Counts a fetched page against its domain's budgets and marks the URL crawled."""
+        domain = site_of(url)
+        self.crawled.add(url)
+        with self._lock:
+            crawled = self._run_crawled[domain] = self._run_crawled.get(domain, 0) + 1
+            if crawled >= self.domain_budget and domain not in self._run_exhausted:
+                self._run_exhausted.add(domain)
+                logger.info(f"Domain budget of {self.domain_budget} pages reached for {domain} this run")
+            # domains.crawled is the all-time count, used for the lifetime cap
+            self._conn.execute(
+                "INSERT INTO domains (domain, crawled) VALUES (?, 1) "
+                "ON CONFLICT(domain) DO UPDATE SET crawled = crawled + 1", (domain,))
+            if self._domain_retired(domain):
+                # Drop the rest of this domain's queue so it does not take up space
+                self._conn.execute("DELETE FROM frontier WHERE domain = ?", (domain,))
+                logger.info(f"Domain lifetime cap of {self.domain_lifetime_cap} pages reached for {domain}")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+    def checkpoint(self):
+        """Persists the Bloom filters (the queue itself is already in SQLite)."""
+        self.seen.save(self._seen_path)
+        self.crawled.save(self._crawled_path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self),
+            "seen": len(self.seen),
+            "crawled": len(self.crawled),
+            "paused": self.paused,
+            "domains": self._conn.execute("SELECT COUNT(*) FROM domains").fetchone()[0],
+            "domains_at_run_budget": len(self._run_exhausted),
+            "bloom_bytes": len(self.seen.bits) + len(self.crawled.bits)
+        }
@@ -0,0 +1,153 @@
+# backend/embedding_cache.py - Disk-backed, content-addressed cache of document embeddings
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Callable, Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-normalised form used for cache keys."""
+    return ' '.join(text.split())
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Maps (model name, SHA-256 of normalised text) to an embedding vector stored as a
+    compact float16/float32 blob in SQLite. Re-ingesting unchanged text (after a URL
+    change, a collection rebuild or a wiped chroma_db) becomes a lookup instead of a
+    model forward pass.
+
+    Entries are evicted least-recently-used once the stored vectors exceed max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, dtype: str = "float16"):
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"Unsupported dtype for EmbeddingCache: {dtype}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                digest BLOB NOT NULL,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, digest)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for texts, None where missing."""
+        digests = [text_digest(t) for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            # Chunk to stay under SQLite's bound-parameter limit
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT digest, dtype, vector FROM embeddings WHERE model = ? AND digest IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for digest, dtype, blob in rows:
+                    found[bytes(digest)] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                    [(now, model, digest) for digest in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(d) for d in digests]
+            hits = sum(r is not None for r in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        now = time.time()
+        rows = [(model, text_digest(t), self.dtype.name, v.tobytes(), now) for t, v in zip(texts, vectors)]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, digest, dtype, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            inserted = self._conn.total_changes - before
+            self._conn.commit()
+            if inserted:
+                self._total_bytes += inserted * vectors[0].nbytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops least-recently-used entries until the cache is at 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        excess = self._total_bytes - target
+        while excess > 0:
+            rows = self._conn.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            victims = []
+            for rowid, size in rows:
+                victims.append((rowid,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE rowid = ?", victims)
+            self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache evicted down to {self._total_bytes / (1024 * 1024):.1f} MB")
+
+    def encode(self, model: str, texts: List[str], encoder: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Returns embeddings for texts, running `encoder` only on texts not in the cache.
+        Rows come back in input order as a float32 matrix.
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        cached = self.get_many(model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            fresh = np.asarray(encoder([texts[i] for i in missing]), dtype=np.float32)
+            self.put_many(model, [texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                cached[i] = vector
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} encoded")
+        return np.vstack(cached)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes
+        }
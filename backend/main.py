@@ -1,18 +1,23 @@
 # backend/main.py - Fixed initialization
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse
 import os
+import json
 from datetime import datetime
 import logging
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 from contextlib import asynccontextmanager
 import hashlib
+import secrets
 
 from mistral_rag import PrivacyRAGSystem
 from smart_crawler import SmartCrawler
 from apscheduler.schedulers.background import BackgroundScheduler
 from privacy_log import log_query
+from profiling import RequestProfiler, span
+from prewarm import PreWarmer
 from search import get_suggestions, search_query as fallback_search
 
 # Configure logging
@@ -26,11 +31,12 @@ async def lifespan(app: FastAPI):
     rag_system = PrivacyRAGSystem()
     app.state.rag_system = rag_system
     app.state.crawler = SmartCrawler(rag_system=rag_system)
+    app.state.prewarmer = PreWarmer(rag_system)
     app.state.scheduler = BackgroundScheduler()
 
-    # --- Add fallback sample documents if ChromaDB is empty ---
-    if rag_system.collection.count() == 0:
-        logger.info("ChromaDB is empty, adding sample documents...")
+    # --- Add fallback sample documents if the vector store is empty ---
+    if rag_system.store.count() == 0:
+        logger.info("Vector store is empty, adding sample documents...")
         sample_docs = [
             {
                 "title": "Artificial Intelligence Fundamentals",
@@ -52,18 +58,22 @@ async def lifespan(app: FastAPI):
             }
         ]
         rag_system.store_documents(sample_docs)
-        logger.info(f"Added {len(sample_docs)} sample documents to ChromaDB")
+        logger.info(f"Added {len(sample_docs)} sample documents to {rag_system.store.storage_type}")
 
-    # --- Try initial crawl (non-blocking) ---
-    try:
-        logger.info("Attempting initial crawl...")
-        app.state.crawler.run()
-        logger.info("Initial crawl completed successfully.")
-    except Exception as e:
-        logger.warning(f"Initial crawl failed: {e}. Using sample data only.")
-
-    # --- Schedule subsequent crawls ---
-    app.state.scheduler.add_job(app.state.crawler.run, 'interval', hours=4, id="periodic_crawl")
+    # --- Schedule crawls, each followed by pre-warming popular answers ---
+    def crawl_and_prewarm():
+        try:
+            app.state.crawler.run()
+        except Exception as e:
+            logger.warning(f"Crawl failed: {e}. Serving the existing knowledge base.")
+        app.state.prewarmer.run()
+
+    # The first crawl starts right away on the scheduler thread, so startup does not wait for it
+    app.state.scheduler.add_job(crawl_and_prewarm, 'interval', hours=4, id="periodic_crawl",
+                                next_run_time=datetime.now())
+    # Popular query text is kept in memory only, so after a restart this warms queries
+    # as they are asked again (see prewarm.QueryPopularity)
+    app.state.scheduler.add_job(app.state.prewarmer.run_if_idle, 'interval', minutes=15, id="idle_prewarm")
     app.state.scheduler.start()
     logger.info("Smart Crawler scheduled to run every 4 hours.")
 
@@ -72,6 +82,9 @@ async def lifespan(app: FastAPI):
     # --- Shutdown ---
     logger.info("Shutting down application resources...")
     app.state.scheduler.shutdown()
+    rag_system.popularity.save()
+    app.state.crawler.extractor.shutdown()
+    app.state.rag_system.close()
 
 app = FastAPI(title="SafeQuery: Privacy-First RAG Search", version="2.0", lifespan=lifespan)
 
@@ -87,14 +100,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling (see profiling.RequestProfiler); no middleware is installed when off
+profiler = RequestProfiler()
+
+if profiler.enabled:
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        trigger = profiler.trigger_for(request.headers)
+        if trigger is None:
+            return await call_next(request)
+        handle = profiler.begin(trigger, request.method, request.url.path)
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            # Streaming responses are timed up to their headers, not the full body
+            profiler.finish(handle, status_code)
+    logger.info("Request profiling enabled.")
+
 # Pydantic models
 class Query(BaseModel):
     query: str
     max_results: Optional[int] = 5
 
+class BatchQuery(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=1000)
+    max_results: int = Field(3, ge=1, le=50)
+    generate_answers: bool = False
+    max_parallel_answers: int = Field(2, ge=1, le=8)
+
 class Feedback(BaseModel):
     feedback: str
 
+class ReembedRequest(BaseModel):
+    model: str
+    batch_size: int = Field(32, ge=1, le=1024)
+    pause_seconds: float = Field(0.2, ge=0)
+    dual_read_rate: float = Field(0.0, ge=0, le=1)
+
+def require_admin(request: Request):
+    """Admin endpoints are hidden unless ADMIN_TOKEN is set and sent as X-Admin-Token"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    supplied = request.headers.get("x-admin-token")
+    if not admin_token or not supplied or not secrets.compare_digest(supplied, admin_token):
+        raise HTTPException(status_code=404, detail="Not found")
+
+def format_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Shape RAG documents for the frontend (content trimmed to 500 chars)"""
+    formatted_results = []
+    for result in results:
+        formatted_results.append({
+            'title': result.get('title', 'Unknown Title'),
+            'content': result.get('content', '')[:500] + '...' if len(result.get('content', '')) > 500 else result.get('content', ''),
+            'url': result.get('url', ''),
+            'score': result.get('score', 0.0),
+            'source': result.get('source', 'unknown')
+        })
+    return formatted_results
+
 @app.get("/")
 def read_root():
     return {
@@ -103,6 +168,7 @@ def read_root():
         "description": "Dynamic web crawling with privacy protection",
         "endpoints": {
             "search": "POST /search - Main search with RAG",
+            "search_batch": "POST /search/batch - Many queries in one request (NDJSON stream)",
             "suggest": "GET /suggest - Get search suggestions",
             "feedback": "POST /feedback - Submit user feedback",
             "stats": "GET /stats - Get knowledge base statistics"
@@ -126,18 +192,12 @@ async def search(query: Query, request: Request, background_tasks: BackgroundTas
 
         try:
             # Use the RAG system
-            results, answer, stats = request.app.state.rag_system.search_and_answer(query_text, max_web_results=3)
+            with span("search_and_answer"):
+                results, answer, stats = request.app.state.rag_system.search_and_answer(query_text, max_web_results=3)
 
             # Format results for frontend
-            formatted_results = []
-            for result in results:
-                formatted_results.append({
-                    'title': result.get('title', 'Unknown Title'),
-                    'content': result.get('content', '')[:500] + '...' if len(result.get('content', '')) > 500 else result.get('content', ''),
-                    'url': result.get('url', ''),
-                    'score': result.get('score', 0.0),
-                    'source': result.get('source', 'unknown')
-                })
+            with span("format_results"):
+                formatted_results = format_results(results)
 
             # Privacy log message
             privacy_log = f"Query processed with privacy protection. Found {stats['documents_found_for_query']} relevant results from {stats['storage_type']} storage. Total documents in knowledge base: {stats['total_documents']}"
@@ -178,6 +238,46 @@ async def search(query: Query, request: Request, background_tasks: BackgroundTas
         logger.error(f"Search endpoint error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during search")
 
+@app.post("/search/batch")
+async def search_batch(batch: BatchQuery, request: Request, background_tasks: BackgroundTasks):
+    """
+    Batch search: all queries are embedded and looked up together, answers are optional.
+    Streams one JSON object per line (NDJSON) as each query completes.
+    """
+    queries = [q.strip() for q in batch.queries]
+    valid = [i for i, q in enumerate(queries) if len(q) >= 2]
+
+    # Log queries anonymously
+    for i in valid:
+        background_tasks.add_task(log_query, queries[i])
+
+    logger.info(f"Processing batch search: {len(valid)} valid of {len(queries)} queries")
+    rag_system = request.app.state.rag_system
+
+    def generate():
+        for i, q in enumerate(queries):
+            if len(q) < 2:
+                yield json.dumps({"index": i, "error": "Query must be at least 2 characters long"}) + "\n"
+        try:
+            results = rag_system.search_and_answer_batch(
+                [queries[i] for i in valid],
+                max_results=batch.max_results,
+                generate_answers=batch.generate_answers,
+                max_parallel=batch.max_parallel_answers
+            )
+            for j, documents, answer in results:
+                yield json.dumps({
+                    "index": valid[j],
+                    "results": format_results(documents),
+                    "answer": answer
+                }) + "\n"
+        except Exception as e:
+            logger.error(f"Batch search error: {e}")
+            yield json.dumps({"error": "Internal server error during batch search"}) + "\n"
+
+    # A sync generator is iterated in the threadpool, so blocking RAG calls don't stall the event loop
+    return StreamingResponse(generate(), media_type="application/x-ndjson", background=background_tasks)
+
 @app.get("/suggest")
 async def suggest(query: str, request: Request):
     """Get search suggestions"""
@@ -264,6 +364,97 @@ async def get_stats(request: Request):
         logger.error(f"Stats error: {e}")
         return {"error": "Could not retrieve statistics"}
 
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """List captured request profiles (requires X-Admin-Token)"""
+    require_admin(request)
+    return {"profiles": profiler.list_dumps()}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Span tree of one captured profile"""
+    require_admin(request)
+    dump = profiler.read_dump(profile_id)
+    if dump is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return dump
+
+@app.get("/admin/profiles/{profile_id}/pstats")
+async def get_profile_pstats(profile_id: str, request: Request):
+    """Raw cProfile stats for a profile, loadable with pstats/snakeviz (event-loop thread only, see pstats_scope)"""
+    require_admin(request)
+    path = profiler.dump_path(profile_id, ".prof")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile stats not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+# Collection admin endpoints are sync so FastAPI runs them in its threadpool: loading a
+# model, joining the build thread and dropping collections must not stall live searches
+@app.get("/admin/collections")
+def collection_status(request: Request):
+    """Active, shadow and retired collection versions plus re-embedding progress"""
+    require_admin(request)
+    return request.app.state.rag_system.collection_status()
+
+@app.post("/admin/collections/shadow")
+def start_reembedding(body: ReembedRequest, request: Request):
+    """Start building a shadow collection with a new embedding model"""
+    require_admin(request)
+    try:
+        migrator = request.app.state.rag_system.start_reembedding(
+            body.model,
+            batch_size=body.batch_size,
+            pause_seconds=body.pause_seconds,
+            dual_read_rate=body.dual_read_rate
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return migrator.status_dict()
+
+@app.delete("/admin/collections/shadow")
+def abort_reembedding(request: Request):
+    """Stop the shadow build and drop the partial collection"""
+    require_admin(request)
+    request.app.state.rag_system.abort_reembedding()
+    return {"message": "Shadow re-embedding aborted."}
+
+@app.post("/admin/collections/switch")
+def switch_collection(request: Request):
+    """Atomically promote the ready shadow collection"""
+    require_admin(request)
+    try:
+        request.app.state.rag_system.switch_collection()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return request.app.state.rag_system.collection_status()
+
+@app.post("/admin/collections/gc")
+def gc_collections(request: Request):
+    """Drop retired collection versions"""
+    require_admin(request)
+    return {"dropped": request.app.state.rag_system.gc_collections()}
+
+@app.get("/admin/crawl")
+async def crawl_status(request: Request):
+    """Crawl frontier size, seen/crawled counts and pause state"""
+    require_admin(request)
+    return request.app.state.crawler.frontier.stats()
+
+@app.post("/admin/crawl/pause")
+async def pause_crawl(request: Request):
+    """Pause the frontier crawl after the current page (persists across restarts)"""
+    require_admin(request)
+    request.app.state.crawler.frontier.pause()
+    return request.app.state.crawler.frontier.stats()
+
+@app.post("/admin/crawl/resume")
+async def resume_crawl(request: Request):
+    """Resume the frontier crawl and start a run now"""
+    require_admin(request)
+    request.app.state.crawler.frontier.resume()
+    request.app.state.scheduler.modify_job("periodic_crawl", next_run_time=datetime.now())
+    return request.app.state.crawler.frontier.stats()
+
 @app.get("/health")
 async def health_check(request: Request):
     """Health check endpoint"""
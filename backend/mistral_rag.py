@@ -1,29 +1,100 @@
 # backend/mistral_rag.py - Contains the PrivacyRAGSystem (RAG logic)
 import ollama
-import chromadb
 import os
 import hashlib
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sentence_transformers import SentenceTransformer
 import re # For cleaning LLM output
 
+import threading
+import time
+from contextlib import contextmanager
+from vector_store import create_vector_store, VectorStore
+from shards import close_shard_pools
+from collection_versions import ActiveIndex, CollectionRegistry, ShadowMigrator
+from embedding_cache import EmbeddingCache
+from profiling import span
+from prewarm import AnswerCache, QueryPopularity
+
 logger = logging.getLogger(__name__)
 
+GENERATION_ERROR_ANSWER = "I apologize, but I encountered an error trying to generate an answer. Please try again."
+
 class PrivacyRAGSystem: # Renamed from MistralRAG for clarity
     def __init__(self):
         # Make the Ollama host configurable via an environment variable
         ollama_host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
         self.client = ollama.Client(host=ollama_host)
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        # Use os.path.join for cross-platform compatibility and relative path
-        db_path = os.path.join(os.path.dirname(__file__), "chroma_db")
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
-        self.collection = self.chroma_client.get_or_create_collection(name="documents")
-        logger.info("ChromaDB and Embedding Model initialized.")
+        # Content-addressed cache so re-ingesting unchanged text skips the model (EMBEDDING_CACHE=0 disables)
+        self.embedding_cache = None
+        if os.getenv("EMBEDDING_CACHE", "1") != "0":
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(os.path.dirname(__file__), "embedding_cache", "embeddings.sqlite3"),
+                max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB", 256)) * 1024 * 1024
+            )
+        # VECTOR_STORE selects the backend: "chroma" (default) or "mmap"
+        self.vector_store_kind = os.getenv("VECTOR_STORE", "chroma")
+        # The registry records which embedding model / collection version is active
+        self.registry = CollectionRegistry(os.path.join(os.path.dirname(__file__), "collections.json"))
+        self._registry_mtime = self.registry.mtime()
+        active = self.registry.load()["active"]
+        self.active = self.open_index(active["model"], active["collection"])
+        self.migrator: Optional[ShadowMigrator] = None
+        # Admin endpoints run in the threadpool; one start/switch/abort/gc at a time
+        self._collections_lock = threading.Lock()
+        self.in_flight = 0  # live searches; background re-embedding and pre-warming wait for zero
+        self._in_flight_lock = threading.Lock()
+        self.last_request_time = 0.0
+        # Bumped whenever the knowledge base changes; cached answers from older generations are stale
+        self.kb_generation = 0
+        self.answer_cache = AnswerCache(
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 1000)),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 6 * 3600))
+        )
+        self.popularity = QueryPopularity(
+            os.path.join(os.path.dirname(__file__), "popular_queries.json"),
+            min_count=int(os.getenv("PREWARM_MIN_QUERY_COUNT", 3)),
+            half_life_hours=float(os.getenv("PREWARM_HALF_LIFE_HOURS", 24))
+        )
+        self._reloading = False
+        logger.info(f"Vector store ({self.store.storage_type}) and Embedding Model initialized.")
+
+    # The active index is swapped as one object so a request never mixes models and collections
+    @property
+    def store(self) -> VectorStore:
+        return self.active.store
+
+    @property
+    def embedding_model(self) -> SentenceTransformer:
+        return self.active.model
+
+    @property
+    def embedding_model_name(self) -> str:
+        return self.active.model_name
+
+    @contextmanager
+    def _live_request(self):
+        """
+        Marks a user-facing request (/search, /search/batch) so background work can
+        yield to it. Internal callers (pre-warming, suggestions) are not marked.
+        """
+        with self._in_flight_lock:
+            self.in_flight += 1
+            self.last_request_time = time.time()
+        try:
+            yield
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def open_index(self, model_name: str, collection: str) -> ActiveIndex:
+        store = create_vector_store(self.vector_store_kind, os.path.dirname(__file__), collection_name=collection)
+        return ActiveIndex(model_name, SentenceTransformer(model_name), collection, store)
 
     def store_documents(self, documents: List[Dict[str, str]]):
-        """Stores processed documents into ChromaDB."""
+        """Stores processed documents into the vector store."""
         if not documents:
             logger.warning("No documents provided to store.")
             return
@@ -32,12 +103,14 @@ class PrivacyRAGSystem: # Renamed from MistralRAG for clarity
         metadatas = []
         documents_content = []
 
-        for doc in documents:
-            # Use URL as ID or hash content if URL is missing
-            doc_id = doc.get('url', hashlib.sha256(doc['content'].encode()).hexdigest())
-            
-            # Check if document already exists to prevent duplicates
-            if self.collection.get(ids=[doc_id])['ids']:
+        # Use URL as ID or hash content if URL is missing
+        doc_ids = [doc.get('url', hashlib.sha256(doc['content'].encode()).hexdigest()) for doc in documents]
+        index = self.active
+        # Check which documents already exist (one lookup for the batch) to prevent duplicates
+        existing_ids = index.store.existing_ids(doc_ids)
+
+        for doc_id, doc in zip(doc_ids, documents):
+            if doc_id in existing_ids or doc_id in ids:
                 logger.info(f"Document with ID {doc_id} already exists, skipping.")
                 continue
 
@@ -53,46 +126,157 @@ class PrivacyRAGSystem: # Renamed from MistralRAG for clarity
             logger.info("All provided documents already exist in the collection.")
             return
 
-        embeddings = self.embedding_model.encode(documents_content).tolist()
+        embeddings = self.embed_documents(documents_content, index=index)
 
-        self.collection.add(
+        index.store.add(
+            ids=ids,
             embeddings=embeddings,
             documents=documents_content,
-            metadatas=metadatas,
-            ids=ids
+            metadatas=metadatas
         )
-        logger.info(f"Stored {len(ids)} new documents in ChromaDB.")
+        if self.migrator is not None:
+            self.migrator.mirror(ids, documents_content, metadatas)
+        self.kb_generation += 1
+        logger.info(f"Stored {len(ids)} new documents in {index.store.storage_type}.")
+
+    def embed_documents(self, texts: List[str], index: ActiveIndex = None):
+        """Encodes document texts, reusing cached embeddings for text seen before."""
+        index = index or self.active
+        if self.embedding_cache is None:
+            return index.model.encode(texts)
+        return self.embedding_cache.encode(index.model_name, texts, index.model.encode)
+
+    def _format_hits(self, hits: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        found_documents = []
+        for hit in hits:
+            metadata = hit['metadata']
+            score = 1 - hit['distance'] # Convert distance to a similarity score (0 to 1)
+            found_documents.append({
+                "title": metadata.get('title', 'No Title'),
+                "content": hit['document'],
+                "url": metadata.get('url', 'No URL'),
+                "domain": metadata.get('domain', 'No Domain'),
+                "score": score,
+                "source": self.store.storage_type
+            })
+        return found_documents
 
     def search_documents(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
-        """Searches ChromaDB for relevant documents based on query."""
-        if self.collection.count() == 0:
-            logger.warning("ChromaDB collection is empty, no documents to search.")
+        """Searches the vector store for relevant documents based on query."""
+        found_documents = self.search_documents_batch([query], max_results=max_results)[0]
+        logger.info(f"Found {len(found_documents)} relevant documents in {self.store.storage_type} for query.")
+        return found_documents
+
+    def search_documents_batch(self, queries: List[str], max_results: int = 5) -> List[List[Dict[str, str]]]:
+        """Searches for many queries at once: one batched encode and one multi-vector store query."""
+        if not queries:
             return []
+        self._check_registry()
+        index = self.active
+        with span("store.count"):
+            empty = index.store.count() == 0
+        if empty:
+            logger.warning("Vector store is empty, no documents to search.")
+            return [[] for _ in queries]
 
-        query_embedding = self.embedding_model.encode(query).tolist()
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=max_results,
-            include=['documents', 'metadatas', 'distances'] # Include distances to calculate score
-        )
+        with span("encode"):
+            query_embeddings = index.model.encode(queries, batch_size=64)
+        with span("store.query"):
+            hits_per_query = index.store.query(query_embeddings, n_results=max_results)
+        if self.migrator is not None:
+            self.migrator.maybe_dual_read(queries, hits_per_query, max_results)
+        return [self._format_hits(hits) for hits in hits_per_query]
 
-        found_documents = []
-        if results and results['documents']:
-            for i in range(len(results['documents'][0])):
-                doc_content = results['documents'][0][i]
-                metadata = results['metadatas'][0][i]
-                distance = results['distances'][0][i]
-                score = 1 - distance # Convert distance to a similarity score (0 to 1)
-                found_documents.append({
-                    "title": metadata.get('title', 'No Title'),
-                    "content": doc_content,
-                    "url": metadata.get('url', 'No URL'),
-                    "domain": metadata.get('domain', 'No Domain'),
-                    "score": score,
-                    "source": "local_chroma_db"
-                })
-        logger.info(f"Found {len(found_documents)} relevant documents in ChromaDB for query.")
-        return found_documents
+    # --- Collection versioning (see collection_versions.ShadowMigrator) ---
+
+    def start_reembedding(self, model_name: str, **options) -> ShadowMigrator:
+        """Builds a shadow collection with model_name in the background."""
+        with self._collections_lock:
+            if self.migrator is not None and self.migrator.status in ("building", "ready"):
+                raise ValueError("A shadow re-embedding is already in progress.")
+            migrator = ShadowMigrator(self, model_name, **options)
+            migrator.start()
+            self.migrator = migrator
+            return migrator
+
+    def switch_collection(self):
+        """Atomically makes the ready shadow collection the active one."""
+        with self._collections_lock:
+            if self.migrator is None:
+                raise ValueError("No shadow re-embedding has been started.")
+            self.migrator.switch()
+            self.kb_generation += 1
+            self._registry_mtime = self.registry.mtime()
+
+    def abort_reembedding(self):
+        with self._collections_lock:
+            if self.migrator is not None:
+                self.migrator.abort()
+                self.migrator = None
+
+    def gc_collections(self) -> List[str]:
+        """Drops retired collections. Run once every worker has picked up the switch."""
+        with self._collections_lock:
+            return self._gc_collections()
+
+    def _gc_collections(self) -> List[str]:
+        state = self.registry.load()
+        dropped = []
+        for entry in state["retired"]:
+            if entry["collection"] == self.active.collection:
+                continue
+            try:
+                # With sharding this goes through the running shard processes; no new ones start
+                store = create_vector_store(self.vector_store_kind, os.path.dirname(__file__),
+                                            collection_name=entry["collection"])
+                try:
+                    store.drop()
+                finally:
+                    store.close()
+                dropped.append(entry["collection"])
+            except Exception as e:
+                logger.warning(f"Could not drop retired collection '{entry['collection']}': {e}")
+        self.registry.update(lambda s: s.update(retired=[r for r in s["retired"] if r["collection"] not in dropped]))
+        logger.info(f"Garbage-collected collections: {dropped}")
+        return dropped
+
+    def close(self):
+        """Releases the active (and any shadow) store and stops shard processes."""
+        shadow = self.migrator.shadow if self.migrator is not None else None
+        if shadow is not None and shadow is not self.active:
+            shadow.store.close()
+        self.store.close()
+        close_shard_pools()
+
+    def collection_status(self) -> Dict[str, Any]:
+        state = self.registry.load()
+        state["migration"] = self.migrator.status_dict() if self.migrator else None
+        return state
+
+    def _check_registry(self):
+        """Picks up a switch made by another worker process; the new index loads in the background."""
+        mtime = self.registry.mtime()
+        if mtime == self._registry_mtime or self._reloading:
+            return
+        self._registry_mtime = mtime
+        active = self.registry.load()["active"]
+        if active["collection"] == self.active.collection:
+            return
+
+        def reload():
+            try:
+                previous = self.active
+                self.active = self.open_index(active["model"], active["collection"])
+                previous.store.close()
+                self.kb_generation += 1
+                logger.info(f"Switched to collection '{active['collection']}' after registry change")
+            except Exception as e:
+                logger.error(f"Could not load collection '{active['collection']}': {e}")
+            finally:
+                self._reloading = False
+
+        self._reloading = True
+        threading.Thread(target=reload, name="collection-reload", daemon=True).start()
 
     def generate_answer(self, query: str, documents: List[Dict[str, str]]) -> str:
         """Generates an answer using Ollama based on query and retrieved documents."""
@@ -104,11 +288,12 @@ class PrivacyRAGSystem: # Renamed from MistralRAG for clarity
         prompt = f"Using the following context, answer the question concisely and accurately. If the answer is not in the context, state that you don't know.\n\nContext:\n{context}\n\nQuestion: {query}\nAnswer:"
 
         try:
-            response = self.client.chat(
-                model=os.getenv("OLLAMA_MODEL", "gemma:2b"), # Use gemma:2b as default for lower RAM
-                messages=[{'role': 'user', 'content': prompt}],
-                stream=False
-            )
+            with span("ollama.chat"):
+                response = self.client.chat(
+                    model=os.getenv("OLLAMA_MODEL", "gemma:2b"), # Use gemma:2b as default for lower RAM
+                    messages=[{'role': 'user', 'content': prompt}],
+                    stream=False
+                )
             answer = response['message']['content'].strip()
             # Clean up common LLM artifacts
             answer = re.sub(r"Based on the context, ", "", answer, flags=re.IGNORECASE)
@@ -118,32 +303,87 @@ class PrivacyRAGSystem: # Renamed from MistralRAG for clarity
             return answer
         except Exception as e:
             logger.error(f"Ollama generation error: {e}")
-            return "I apologize, but I encountered an error trying to generate an answer. Please try again."
+            return GENERATION_ERROR_ANSWER
 
     def get_knowledge_base_stats(self) -> Dict[str, Any]:
-        """Returns statistics about the ChromaDB knowledge base."""
+        """Returns statistics about the vector store knowledge base."""
         stats = {
-            "total_documents": self.collection.count(),
-            "storage_type": "local_chroma_db"
+            "total_documents": self.store.count(),
+            "storage_type": self.store.storage_type
         }
+        if self.embedding_cache is not None:
+            stats["embedding_cache"] = self.embedding_cache.stats()
         logger.info(f"Knowledge base stats: {stats}")
         return stats
 
-    def search_and_answer(self, query: str, max_web_results: int = 3) -> (list, str, dict):
+    def search_and_answer(self, query: str, max_web_results: int = 3, background: bool = False) -> (list, str, dict):
         """
         A single method to perform the entire RAG process: search, generate, and return stats.
+        Live calls are counted for pre-warming and served from the answer cache when fresh;
+        background=True (the pre-warmer) always recomputes and refreshes the cache.
         """
+        if not background:
+            # Cache hits are live traffic too: the idle pre-warm must not start at peak
+            with self._live_request():
+                self.popularity.record(query)
+                cached = self.answer_cache.get(query, max_web_results, self.kb_generation)
+                if cached is not None:
+                    logger.info("RAG result served from answer cache.")
+                    return cached
+                return self._search_and_answer(query, max_web_results)
+        return self._search_and_answer(query, max_web_results)
+
+    def _search_and_answer(self, query: str, max_web_results: int) -> (list, str, dict):
+        generation = self.kb_generation
         logger.info(f"Performing RAG search for query: '{query}'")
 
         # 1. Search for relevant documents in the knowledge base
-        documents = self.search_documents(query, max_results=max_web_results) # Use the passed parameter
+        with span("search_documents"):
+            documents = self.search_documents(query, max_results=max_web_results) # Use the passed parameter
 
         # 2. Generate an answer using the retrieved documents
-        answer = self.generate_answer(query, documents)
+        with span("generate_answer"):
+            answer = self.generate_answer(query, documents)
 
         # 3. Compile statistics about the operation
-        stats = self.get_knowledge_base_stats()
+        with span("get_knowledge_base_stats"):
+            stats = self.get_knowledge_base_stats()
         stats["documents_found_for_query"] = len(documents)
         stats["answer_length"] = len(answer)
         logger.info(f"RAG search completed for '{query}'. Docs found: {len(documents)}, Answer length: {len(answer)}")
-        return documents, answer, stats
\ No newline at end of file
+        if answer != GENERATION_ERROR_ANSWER:  # don't pin a transient Ollama failure in the cache
+            self.answer_cache.put(query, max_web_results, generation, (documents, answer, stats))
+        return documents, answer, stats
+
+    def search_and_answer_batch(self, queries: List[str], max_results: int = 3, generate_answers: bool = False,
+                                max_parallel: int = 2) -> Iterator[Tuple[int, list, Optional[str]]]:
+        """
+        Batch variant of search_and_answer. Retrieval for all queries happens up front;
+        yields (index, documents, answer) tuples, in query order when answers are off and
+        in completion order otherwise. At most `max_parallel` Ollama calls run at once.
+        """
+        logger.info(f"Performing batch RAG search for {len(queries)} queries (answers: {generate_answers})")
+        with self._live_request():
+            yield from self._search_and_answer_batch(queries, max_results, generate_answers, max_parallel)
+
+    def _search_and_answer_batch(self, queries: List[str], max_results: int, generate_answers: bool,
+                                 max_parallel: int) -> Iterator[Tuple[int, list, Optional[str]]]:
+        documents_per_query = self.search_documents_batch(queries, max_results=max_results)
+
+        if not generate_answers:
+            for i, documents in enumerate(documents_per_query):
+                yield i, documents, None
+            return
+
+        pool = ThreadPoolExecutor(max_workers=max(1, max_parallel))
+        try:
+            futures = {
+                pool.submit(self.generate_answer, query, documents): i
+                for i, (query, documents) in enumerate(zip(queries, documents_per_query))
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                yield i, documents_per_query[i], future.result()
+        finally:
+            # If the consumer stops early (e.g. client disconnect), drop queued generations
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,234 @@
+# backend/prewarm.py - Answer cache, privacy-preserving query popularity and idle-time pre-warming
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class AnswerCache:
+    """
+    LRU cache of search_and_answer results keyed by normalised query and result count.
+    Entries carry the knowledge base generation they were computed against, so any
+    ingest makes them stale without an explicit flush.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 6 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[int, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str, max_results: int, generation: int) -> Optional[Any]:
+        key = (normalize_query(query), max_results)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation or time.time() - entry[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def is_fresh(self, query: str, max_results: int, generation: int) -> bool:
+        entry = self._entries.get((normalize_query(query), max_results))
+        # Refresh a little before expiry so pre-warmed answers survive until the next run
+        return entry is not None and entry[0] == generation and time.time() - entry[1] < self.ttl_seconds * 0.8
+
+    def put(self, query: str, max_results: int, generation: int, value: Any):
+        key = (normalize_query(query), max_results)
+        with self._lock:
+            self._entries[key] = (generation, time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class QueryPopularity:
+    """
+    Counts query frequency without keeping a query log. Queries are counted under a
+    keyed hash (HMAC); the normalised text is held in memory once a query has been
+    seen `min_count` times, so the pre-warmer knows what to recompute.
+
+    Query text is never written to disk. `min_count` counts requests, not people, so
+    one user repeating a private question would pass it; persisting text gated on it
+    would leak exactly that. Only the HMAC counts are saved (the key lives next to
+    them in <path>.key, owner-readable only), so popularity survives a restart and a
+    query that was already popular is re-learned the first time it is asked again.
+    Counts decay with wall-clock time (`half_life_hours`), however often decay() runs.
+    """
+
+    def __init__(self, path: str, min_count: int = 3, max_tracked: int = 10000, half_life_hours: float = 24.0):
+        self.path = path
+        self.min_count = min_count
+        self.max_tracked = max_tracked
+        self.half_life_seconds = half_life_hours * 3600
+        self._decayed_at = time.time()
+        self._key = self._load_key(path + ".key")
+        self._counts = {}  # hmac digest -> count
+        self._popular = {}  # hmac digest -> normalised text, only for count >= min_count
+        self._lock = threading.Lock()
+        self._load()
+
+    def _digest(self, text: str) -> bytes:
+        return hmac.new(self._key, text.encode("utf-8"), hashlib.sha256).digest()
+
+    @staticmethod
+    def _load_key(key_path: str) -> bytes:
+        try:
+            with open(key_path, "rb") as f:
+                key = f.read()
+            if len(key) == 32:
+                return key
+            logger.warning(f"Ignoring malformed popularity key {key_path}; counts start over")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not read popularity key {key_path}: {e}")
+        key = secrets.token_bytes(32)
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+        except OSError as e:
+            # Still usable for this process; counts just won't carry over a restart
+            logger.warning(f"Could not save popularity key {key_path}: {e}")
+        return key
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            # Files from older versions also hold a "popular" text list; it is not read
+            # back and is gone after the next save()
+            for digest, count in saved.get("counts", []):
+                self._counts[bytes.fromhex(digest)] = count
+            self._decayed_at = saved.get("decayed_at", self._decayed_at)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load query popularity from {self.path}: {e}")
+
+    def record(self, query: str):
+        text = normalize_query(query)
+        if not text:
+            return
+        digest = self._digest(text)
+        with self._lock:
+            count = self._counts.get(digest, 0) + 1
+            self._counts[digest] = count
+            if count >= self.min_count:
+                self._popular[digest] = text
+            if len(self._counts) > self.max_tracked:
+                self._prune()
+
+    def _prune(self):
+        """Drops the least frequent half of the tracked hashes."""
+        keep = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)[:self.max_tracked // 2]
+        self._counts = dict(keep)
+        self._popular = {d: t for d, t in self._popular.items() if d in self._counts}
+
+    def top(self, n: int) -> List[str]:
+        with self._lock:
+            ranked = sorted(self._popular.items(), key=lambda item: self._counts.get(item[0], 0), reverse=True)
+            return [text for _, text in ranked[:n]]
+
+    def decay(self):
+        """Ages counts by the time elapsed since the last decay so yesterday's spike does not dominate forever."""
+        with self._lock:
+            now = time.time()
+            factor = 0.5 ** (max(0.0, now - self._decayed_at) / self.half_life_seconds)
+            self._decayed_at = now
+            self._counts = {d: c * factor for d, c in self._counts.items() if c * factor >= 0.5}
+            self._popular = {d: t for d, t in self._popular.items() if d in self._counts}
+
+    def save(self):
+        """Persists the HMAC counts only; see the class docstring."""
+        with self._lock:
+            counts = [[digest.hex(), count] for digest, count in self._counts.items()]
+            decayed_at = self._decayed_at
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"counts": counts, "decayed_at": decayed_at}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save query popularity: {e}")
+
+
+class PreWarmer:
+    """
+    Recomputes results and answers for the most popular queries so the first users
+    after a crawl or restart are served from the answer cache.
+
+    Each run is capped by PREWARM_MAX_ANSWERS generations and PREWARM_BUDGET_SECONDS
+    of wall time, and waits whenever live searches are in flight.
+    """
+
+    def __init__(self, rag_system, top_n: int = None, max_answers: int = None,
+                 budget_seconds: float = None, idle_seconds: float = None):
+        self.rag_system = rag_system
+        self.top_n = top_n or int(os.getenv("PREWARM_TOP_N", 20))
+        self.max_answers = max_answers or int(os.getenv("PREWARM_MAX_ANSWERS", 20))
+        self.budget_seconds = budget_seconds or float(os.getenv("PREWARM_BUDGET_SECONDS", 120))
+        self.idle_seconds = idle_seconds or float(os.getenv("PREWARM_IDLE_SECONDS", 300))
+        self._running = threading.Lock()
+
+    def run(self, max_web_results: int = 3) -> int:
+        """Pre-warms the top queries; returns how many answers were computed."""
+        if not self._running.acquire(blocking=False):
+            logger.info("Pre-warm already running, skipping.")
+            return 0
+        try:
+            return self._run(max_web_results)
+        finally:
+            self._running.release()
+
+    def run_if_idle(self):
+        """Scheduler hook: only pre-warm when no live search arrived recently."""
+        if time.time() - self.rag_system.last_request_time >= self.idle_seconds:
+            self.run()
+
+    def _run(self, max_web_results: int) -> int:
+        rag = self.rag_system
+        deadline = time.time() + self.budget_seconds
+        computed = 0
+        queries = rag.popularity.top(self.top_n)
+        logger.info(f"Pre-warming answer cache for up to {len(queries)} popular queries")
+
+        for query in queries:
+            if computed >= self.max_answers or time.time() >= deadline:
+                break
+            if rag.answer_cache.is_fresh(query, max_web_results, rag.kb_generation):
+                continue
+            # Yield to live traffic; give up on this run if it never quiets down
+            while rag.in_flight > 0 and time.time() < deadline:
+                time.sleep(0.1)
+            if time.time() >= deadline:
+                break
+            try:
+                rag.search_and_answer(query, max_web_results=max_web_results, background=True)
+                computed += 1
+            except Exception as e:
+                logger.warning(f"Pre-warm failed for a popular query: {e}")
+
+        rag.popularity.decay()
+        rag.popularity.save()
+        logger.info(f"Pre-warm finished: {computed} answers computed")
+        return computed
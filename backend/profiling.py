@@ -0,0 +1,241 @@
+# backend/profiling.py - Opt-in per-request timing spans and slow-request capture
+import os
+import re
+import json
+import time
+import random
+import secrets
+import logging
+import cProfile
+import threading
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+_current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+_PROFILE_ID_RE = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$")
+# cProfile hooks one thread: it runs on the event loop thread for the request's wall-clock
+# duration, so it also sees other requests served meanwhile and misses threadpool work
+# (sync endpoints, run_in_threadpool, asyncio.to_thread). Use the spans for those.
+PSTATS_SCOPE = ("event-loop thread only, for the request's duration: includes other requests "
+                "served concurrently, excludes work run in the threadpool")
+
+
+class Span:
+    __slots__ = ("name", "start", "end", "children")
+
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.end = None
+        self.children: List["Span"] = []
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "children": [child.to_dict(origin) for child in self.children]
+        }
+
+
+class RequestProfile:
+    """Span tree (and optional cProfile) for one request."""
+
+    def __init__(self, trigger: str, method: str, path: str, use_cprofile: bool):
+        self.trigger = trigger
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.root = Span(f"{method} {path}", time.perf_counter())
+        self.stack = [self.root]
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+
+
+class _NullSpan:
+    """Returned by span() when no profile is active; entering it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _SpanContext:
+    __slots__ = ("profile", "name", "span")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.span = Span(self.name, time.perf_counter())
+        self.profile.stack[-1].children.append(self.span)
+        self.profile.stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        self.profile.stack.pop()
+        return False
+
+
+def span(name: str):
+    """
+    Times a block as a child of the current request's span tree:
+
+        with span("encode"):
+            ...
+
+    Costs a single ContextVar lookup when the request is not being profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return _NULL_SPAN
+    return _SpanContext(profile, name)
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and keeps dumps in a bounded on-disk ring buffer.
+
+    Configuration (environment):
+      PROFILE_TOKEN        - enables the X-Profile request header (value must match)
+      PROFILE_SAMPLE_RATE  - fraction of requests to profile, e.g. 0.01
+      PROFILE_SLOW_MS      - record spans for every request, keep only those slower than this
+      PROFILE_CPROFILE     - also capture cProfile stats for header/sampled requests
+                             (event-loop thread only; see PSTATS_SCOPE)
+      PROFILE_MAX_DUMPS    - ring buffer size (default 50)
+      PROFILE_DIR          - dump directory (default backend/profiles)
+
+    Nothing is installed when none of the triggers is configured.
+    """
+
+    def __init__(self, dump_dir: str = None):
+        self.token = os.getenv("PROFILE_TOKEN") or None
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        self.slow_ms = float(os.getenv("PROFILE_SLOW_MS", 0))
+        self.use_cprofile = os.getenv("PROFILE_CPROFILE", "0") == "1"
+        self.max_dumps = int(os.getenv("PROFILE_MAX_DUMPS", 50))
+        self.dump_dir = dump_dir or os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+        # Only one cProfile may be active per thread; requests share the event loop thread
+        self._cprofile_lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0 or self.slow_ms > 0
+
+    def trigger_for(self, headers) -> Optional[str]:
+        if self.token and headers.get("x-profile") == self.token:
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        if self.slow_ms > 0:
+            return "slow"
+        return None
+
+    def begin(self, trigger: str, method: str, path: str):
+        """Starts profiling the current request; returns the handle to pass to finish()."""
+        want_cprofile = self.use_cprofile and trigger != "slow" and self._cprofile_lock.acquire(blocking=False)
+        profile = RequestProfile(trigger, method, path, use_cprofile=want_cprofile)
+        if profile.cprofile is not None:
+            profile.cprofile.enable()
+        return profile, _current_profile.set(profile)
+
+    def finish(self, handle, status_code: int):
+        profile, context_token = handle
+        _current_profile.reset(context_token)
+        profile.root.end = time.perf_counter()
+        if profile.cprofile is not None:
+            profile.cprofile.disable()
+            self._cprofile_lock.release()
+
+        duration_ms = (profile.root.end - profile.root.start) * 1000
+        if profile.trigger == "slow" and duration_ms < self.slow_ms:
+            return None
+        try:
+            return self._write_dump(profile, status_code, duration_ms)
+        except OSError as e:
+            logger.warning(f"Could not write profile dump: {e}")
+            return None
+
+    def _write_dump(self, profile: RequestProfile, status_code: int, duration_ms: float) -> str:
+        profile_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(profile.started_at)) + "-" + secrets.token_hex(4)
+        dump = {
+            "id": profile_id,
+            "timestamp": profile.started_at,
+            "trigger": profile.trigger,
+            "method": profile.method,
+            "path": profile.path,  # path only: query text is never written to disk
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 3),
+            "has_pstats": profile.cprofile is not None,
+            "pstats_scope": PSTATS_SCOPE if profile.cprofile is not None else None,
+            "spans": profile.root.to_dict(profile.root.start)
+        }
+        with self._dump_lock:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            if profile.cprofile is not None:
+                profile.cprofile.dump_stats(os.path.join(self.dump_dir, profile_id + ".prof"))
+            with open(os.path.join(self.dump_dir, profile_id + ".json"), "w", encoding="utf-8") as f:
+                json.dump(dump, f)
+            self._evict()
+        logger.info(f"Profile {profile_id} captured ({profile.trigger}, {duration_ms:.1f} ms)")
+        return profile_id
+
+    def _dump_ids(self) -> List[str]:
+        """Dump ids, oldest first."""
+        entries = []
+        for name in os.listdir(self.dump_dir):
+            if name.endswith(".json"):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.dump_dir, name)), name[:-5]))
+                except OSError:
+                    continue  # evicted concurrently
+        return [profile_id for _, profile_id in sorted(entries)]
+
+    def _evict(self):
+        ids = self._dump_ids()
+        for old_id in ids[:max(0, len(ids) - self.max_dumps)]:
+            for ext in (".json", ".prof"):
+                path = os.path.join(self.dump_dir, old_id + ext)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # --- Admin access ---
+
+    def list_dumps(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.dump_dir):
+            return []
+        summaries = []
+        for profile_id in reversed(self._dump_ids()):
+            dump = self.read_dump(profile_id)
+            if dump:
+                summary = {k: dump[k] for k in ("id", "timestamp", "trigger", "method", "path",
+                                                "status_code", "duration_ms", "has_pstats")}
+                summary["pstats_scope"] = PSTATS_SCOPE if dump["has_pstats"] else None
+                summaries.append(summary)
+        return summaries
+
+    def dump_path(self, profile_id: str, ext: str) -> Optional[str]:
+        if not _PROFILE_ID_RE.match(profile_id):
+            return None
+        path = os.path.join(self.dump_dir, profile_id + ext)
+        return path if os.path.exists(path) else None
+
+    def read_dump(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self.dump_path(profile_id, ".json")
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # evicted or half-written
@@ -0,0 +1,347 @@
+# backend/shards.py - Knowledge base partitioned across local shard processes (scatter-gather)
+import os
+import json
+import hashlib
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, wait
+from typing import List, Dict, Any, Set, Iterator, Tuple
+
+from vector_store import VectorStore, create_single_vector_store
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("url", "domain")
+# Methods a shard process will execute on behalf of the parent
+_SHARD_METHODS = {"open", "count", "existing_ids", "add", "query", "drop", "release", "iter_open", "iter_next"}
+# Request id of the message a shard process sends once it is ready to serve
+_READY = -1
+
+# One pool of shard processes per store directory, shared by every collection in it
+_pools: Dict[Tuple[str, str], "ShardPool"] = {}
+_pools_lock = threading.Lock()
+
+
+def shard_for(key: str, n_shards: int) -> int:
+    """Stable shard assignment (Python's hash() is salted per process)."""
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % n_shards
+
+
+def _serve_shard(conn, kind: str, path: str):
+    """
+    Shard process main loop: owns this shard's vector stores, one per collection,
+    and answers requests in order. Stores are opened on first use, so the active
+    and shadow collections share one process (and one chroma client per path);
+    "open" does that eagerly, so a new store pays for it before serving queries.
+    """
+    stores: Dict[str, VectorStore] = {}
+    iterators: Dict[int, Iterator] = {}
+    iterator_ids = itertools.count()
+
+    def store_for(collection: str) -> VectorStore:
+        store = stores.get(collection)
+        if store is None:
+            store = stores[collection] = create_single_vector_store(kind, path, collection_name=collection)
+        return store
+
+    # Imports are done by the time this runs; tell the parent the process is up
+    conn.send((_READY, True, None))
+    while True:
+        try:
+            request_id, collection, method, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        if method == "close":
+            break
+        try:
+            if method not in _SHARD_METHODS:
+                raise ValueError(f"Unsupported shard method: {method}")
+            if method == "iter_open":
+                token = next(iterator_ids)
+                iterators[token] = store_for(collection).iter_documents(batch_size=args[0])
+                result = token
+            elif method == "iter_next":
+                result = next(iterators[args[0]], None)
+                if result is None:
+                    iterators.pop(args[0], None)
+            elif method == "open":
+                store_for(collection)
+                result = None
+            elif method == "release":
+                store = stores.pop(collection, None)
+                if store is not None:
+                    store.close()
+                result = None
+            else:
+                result = getattr(store_for(collection), method)(*args)
+                if method == "drop":
+                    stores.pop(collection).close()
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+    for store in stores.values():
+        store.close()
+    conn.close()
+
+
+class ShardClient:
+    """Parent-side handle for one shard process; calls return Futures matched by request id."""
+
+    def __init__(self, index: int, kind: str, path: str):
+        self.index = index
+        # spawn, not fork: the web process is multi-threaded (scheduler, torch)
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_serve_shard, args=(child_conn, kind, path),
+            name=f"shard-{index}", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self._pending: Dict[int, Future] = {_READY: Future()}
+        self.ready = self._pending[_READY]
+        self._request_ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name=f"shard-{index}-reader", daemon=True)
+        self._reader.start()
+
+    def call(self, collection: str, method: str, *args) -> Future:
+        future = Future()
+        request_id = next(self._request_ids)
+        self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                self.conn.send((request_id, collection, method, args))
+        except (OSError, ValueError) as e:
+            self._pending.pop(request_id, None)
+            future.set_exception(RuntimeError(f"Shard {self.index} is not reachable: {e}"))
+        return future
+
+    def _read_loop(self):
+        while True:
+            try:
+                request_id, ok, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            # A response for a request the caller already timed out on is simply dropped
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Shard {self.index}: {payload}"))
+        for future in list(self._pending.values()):
+            future.set_exception(RuntimeError(f"Shard {self.index} exited"))
+        self._pending.clear()
+
+    def close(self):
+        try:
+            with self._send_lock:
+                self.conn.send((-1, None, "close", ()))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class ShardPool:
+    """
+    The shard processes for one store directory (<base_dir>/shards/shard-<i>).
+
+    The shard count and strategy are recorded in shards.json; changing them would
+    orphan documents, so a mismatch is refused. The constructor returns once every
+    process has started (spawning re-imports numpy/torch/chromadb), waiting at most
+    startup_timeout seconds.
+    """
+
+    def __init__(self, kind: str, base_dir: str, n_shards: int, strategy: str, startup_timeout: float = 120.0):
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"Unknown shard strategy '{strategy}', expected one of {SHARD_STRATEGIES}")
+        self.kind = kind
+        self.n_shards = n_shards
+        self.strategy = strategy
+        shards_dir = os.path.join(base_dir, "shards")
+        self._check_layout(shards_dir)
+        self.shards = [
+            ShardClient(i, kind, os.path.join(shards_dir, f"shard-{i}"))
+            for i in range(n_shards)
+        ]
+        done, not_done = wait([shard.ready for shard in self.shards], timeout=startup_timeout)
+        failed = [shard.index for shard in self.shards if shard.ready in not_done or shard.ready.exception()]
+        if failed:
+            self.close()
+            raise RuntimeError(f"Shard processes {failed} did not start within {startup_timeout}s")
+        logger.info(f"Started {n_shards} shard processes ({kind}, by {strategy}) under {shards_dir}")
+
+    def _check_layout(self, shards_dir: str):
+        os.makedirs(shards_dir, exist_ok=True)
+        layout_path = os.path.join(shards_dir, "shards.json")
+        layout = {"n_shards": self.n_shards, "strategy": self.strategy}
+        if os.path.exists(layout_path):
+            with open(layout_path, "r", encoding="utf-8") as f:
+                existing = json.load(f)
+            if existing != layout:
+                raise ValueError(f"Shard layout {layout} does not match existing layout {existing}; "
+                                 f"re-shard the knowledge base before changing it.")
+        else:
+            with open(layout_path, "w", encoding="utf-8") as f:
+                json.dump(layout, f)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def get_shard_pool(kind: str, base_dir: str, n_shards: int, strategy: str = "url",
+                   startup_timeout: float = 120.0) -> ShardPool:
+    """Returns the running pool for base_dir, starting its processes on first use."""
+    key = (kind, os.path.abspath(base_dir))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ShardPool(kind, base_dir, n_shards, strategy, startup_timeout)
+        elif (pool.n_shards, pool.strategy) != (n_shards, strategy):
+            raise ValueError(f"Shard pool for {base_dir} already runs {pool.n_shards} shards by {pool.strategy}")
+        return pool
+
+
+def close_shard_pools():
+    """Stops every shard process started by this process (app shutdown)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    Spreads a collection over the N shard processes of a ShardPool, each keeping
+    its part under <base_dir>/shards/shard-<i>. Documents are routed by a stable
+    hash of their id (the URL) or of their domain. Queries are embedded once in
+    the web process, sent to every shard in parallel, and the per-shard top-k lists
+    are merged by distance; shards that miss `timeout` seconds are left out of the
+    result rather than holding the request. Only queries are cut short: counts,
+    dedup checks and writes wait for every shard and raise if one fails, since a
+    partial answer there would be wrong rather than just less complete.
+
+    Stores for different collections (active, shadow, retired) share the pool, so
+    creating one does not start processes and close() only releases the
+    collection's handles inside the shards. The constructor opens the collection
+    in every shard (waiting up to startup_timeout), so the first query does not
+    pay for it inside `timeout`.
+    """
+
+    def __init__(self, kind: str, base_dir: str, collection_name: str, n_shards: int,
+                 strategy: str = "url", timeout: float = 2.0, startup_timeout: float = 120.0):
+        self.pool = get_shard_pool(kind, base_dir, n_shards, strategy, startup_timeout)
+        self.collection_name = collection_name
+        self.n_shards = n_shards
+        self.strategy = strategy
+        self.timeout = timeout
+        self.storage_type = f"sharded_{kind}"
+        self.shards = self.pool.shards
+        futures = [shard.call(collection_name, "open") for shard in self.shards]
+        done, not_done = wait(futures, timeout=startup_timeout)
+        if not_done:
+            raise RuntimeError(f"Shards did not open collection '{collection_name}' within {startup_timeout}s")
+        for future in done:
+            future.result()
+
+    def _route_key(self, doc_id: str, metadata: Dict[str, Any]) -> str:
+        if self.strategy == "domain":
+            return metadata.get("domain") or doc_id
+        return doc_id
+
+    def _gather(self, method: str, *args, shards: List[ShardClient] = None) -> List[Tuple[int, Any]]:
+        """Calls method on shards in parallel; returns (shard index, result) for shards that answered in time."""
+        shards = self.shards if shards is None else shards
+        futures = {shard.call(self.collection_name, method, *args): shard.index for shard in shards}
+        done, not_done = wait(futures, timeout=self.timeout)
+        results = []
+        for future in done:
+            if future.exception() is not None:
+                logger.warning(f"{method} failed on shard {futures[future]}: {future.exception()}")
+            else:
+                results.append((futures[future], future.result()))
+        for future in not_done:
+            logger.warning(f"Shard {futures[future]} timed out on {method} after {self.timeout}s")
+        if not results and shards:
+            raise RuntimeError(f"No shard answered {method}")
+        return results
+
+    def _call_all(self, method: str, *args) -> List[Any]:
+        """Calls method on every shard and waits for all of them; any failure raises."""
+        futures = [shard.call(self.collection_name, method, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    # --- VectorStore interface ---
+
+    def count(self) -> int:
+        return sum(self._call_all("count"))
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        if not ids:
+            return set()
+        if self.strategy == "domain":
+            # The owning shard depends on metadata we don't have here, so ask all of them
+            return set().union(*self._call_all("existing_ids", list(ids)))
+        by_shard: Dict[int, List[str]] = {}
+        for doc_id in ids:
+            by_shard.setdefault(shard_for(doc_id, self.n_shards), []).append(doc_id)
+        futures = [self.shards[i].call(self.collection_name, "existing_ids", shard_ids)
+                   for i, shard_ids in by_shard.items()]
+        # A missing answer would re-add documents, so wait like add() does
+        return set().union(*(future.result() for future in futures))
+
+    def add(self, ids, embeddings, documents, metadatas):
+        if hasattr(embeddings, 'tolist'):
+            embeddings = embeddings.tolist()
+        by_shard: Dict[int, List[int]] = {}
+        for i, (doc_id, metadata) in enumerate(zip(ids, metadatas)):
+            by_shard.setdefault(shard_for(self._route_key(doc_id, metadata), self.n_shards), []).append(i)
+        futures = []
+        for shard_index, rows in by_shard.items():
+            futures.append(self.shards[shard_index].call(
+                self.collection_name, "add",
+                [ids[r] for r in rows],
+                [embeddings[r] for r in rows],
+                [documents[r] for r in rows],
+                [metadatas[r] for r in rows]
+            ))
+        # Writes must not be dropped silently, so wait without the query timeout
+        for future in futures:
+            future.result()
+
+    def query(self, query_embeddings, n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        if hasattr(query_embeddings, 'tolist'):
+            query_embeddings = query_embeddings.tolist()
+        per_shard = self._gather("query", query_embeddings, n_results)
+        merged = []
+        for q in range(len(query_embeddings)):
+            hits = [hit for _, results in per_shard for hit in results[q]]
+            hits.sort(key=lambda hit: hit["distance"])
+            merged.append(hits[:n_results])
+        return merged
+
+    def iter_documents(self, batch_size: int = 256):
+        for shard in self.shards:
+            token = shard.call(self.collection_name, "iter_open", batch_size).result()
+            while True:
+                batch = shard.call(self.collection_name, "iter_next", token).result()
+                if batch is None:
+                    break
+                yield batch
+
+    def drop(self):
+        self._call_all("drop")
+
+    def close(self):
+        """Releases this collection's handles in the shards; the processes keep serving the pool."""
+        futures = [shard.call(self.collection_name, "release") for shard in self.shards]
+        wait(futures, timeout=self.timeout)
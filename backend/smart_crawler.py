@@ -1,19 +1,24 @@
 # backend/smart_crawler.py - Fixed version with better error handling
 import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin, unquote
+import os
 import logging
 import time
 import random
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Tuple
 import hashlib
 import re
 
+from content_extractor import ContentExtractor
+from crawl_frontier import CrawlFrontier, RobotsCache, normalize_url, site_of
+
 logger = logging.getLogger(__name__)
 
 class SmartCrawler:
-    def __init__(self, rag_system, crawl_topics: List[str] = None, blocked_domains: List[str] = None):
+    def __init__(self, rag_system, crawl_topics: List[str] = None, blocked_domains: List[str] = None,
+                 extractor: ContentExtractor = None, frontier: CrawlFrontier = None):
         self.rag_system = rag_system
+        self.extractor = extractor or ContentExtractor()
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -34,7 +39,18 @@ class SmartCrawler:
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
         ]
-        self.crawled_urls = set()
+        # Persistent frontier; its crawled-URL Bloom filter replaces the old unbounded set
+        self.frontier = frontier if frontier is not None else CrawlFrontier(
+            os.path.join(os.path.dirname(__file__), "crawl_state"),
+            max_depth=int(os.getenv("CRAWL_MAX_DEPTH", 2)),
+            domain_budget=int(os.getenv("CRAWL_DOMAIN_BUDGET", 200)),
+            domain_lifetime_cap=int(os.getenv("CRAWL_DOMAIN_LIFETIME_CAP", 0)),
+            bloom_capacity=int(os.getenv("CRAWL_BLOOM_CAPACITY", 1_000_000))
+        )
+        self.crawled_urls = self.frontier.crawled
+        self.robots = RobotsCache(self.session)
+        self.max_pages_per_run = int(os.getenv("CRAWL_MAX_PAGES_PER_RUN", 50))
+        self.max_crawl_delay = float(os.getenv("CRAWL_MAX_DELAY_SECONDS", 30))
 
     def anonymize_query(self, query: str) -> str:
         """Hash the query for privacy logging"""
@@ -108,81 +124,47 @@ class SmartCrawler:
         except Exception:
             return False
 
-    def extract_content(self, url: str) -> Dict[str, str]:
-        """Extract content from URL with better error handling"""
-        if url in self.crawled_urls:
-            return None
-
+    def fetch_page(self, url: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Fetch raw HTML for a URL with a polite delay; returns (html, final URL after
+        redirects), or None on failure
+        """
         try:
             time.sleep(random.uniform(1, 2))  # Shorter delay
             self.session.headers['User-Agent'] = random.choice(self.user_agents)
 
             response = self.session.get(url, timeout=10, allow_redirects=True)
             response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Remove unwanted elements
-            for tag in soup(['script', 'style', 'nav', 'header', 'footer', 'aside']):
-                tag.decompose()
-
-            # Extract title
-            title_tag = soup.find('title')
-            title = title_tag.get_text().strip() if title_tag else "Unknown Title"
-
-            # Extract main content - more aggressive
-            content = ""
-
-            # Try multiple content selectors
-            content_selectors = ['article', 'main', '.content', '[role="main"]', 'section', 'div.post']
-            for selector in content_selectors:
-                elements = soup.select(selector)
-                if elements:
-                    content = ' '.join([elem.get_text().strip() for elem in elements])
-                    if len(content) > 100:  # Good content found
-                        break
-
-            # Fallback: get all paragraph text
-            if len(content) < 100:
-                paragraphs = soup.find_all('p')
-                content = ' '.join([p.get_text().strip() for p in paragraphs])
-
-            # Final fallback: body text
-            if len(content) < 100:
-                body = soup.find('body')
-                if body:
-                    content = body.get_text(separator=' ', strip=True)
-
-            # Clean content
-            content = ' '.join(content.split())  # Remove extra whitespace
-            content = re.sub(r'\s+', ' ', content)  # Normalize whitespace
-
-            # Validate content quality
-            if len(content) < 50:
-                logger.warning(f"Low quality content from {url}: {len(content)} chars")
-                return None
-
-            self.crawled_urls.add(url)
-
-            result = {
-                'title': title[:200],
-                'content': content[:3000],  # Reasonable limit
-                'url': url,
-                'domain': urlparse(url).netloc
-            }
-
-            logger.info(f"Successfully extracted content from {url}: {len(content)} chars")
-            return result
+            return response.content, response.url
 
         except requests.exceptions.Timeout:
             logger.warning(f"Timeout extracting {url}")
         except requests.exceptions.RequestException as e:
             logger.warning(f"Request error for {url}: {e}")
         except Exception as e:
-            logger.warning(f"Error extracting content from {url}: {e}")
+            logger.warning(f"Error fetching {url}: {e}")
 
         return None
 
+    def build_article(self, url: str, title: str, content: str) -> Optional[Dict[str, str]]:
+        """Validate extracted text and shape it into an article dict"""
+        # Validate content quality
+        if len(content) < 50:
+            logger.warning(f"Low quality content from {url}: {len(content)} chars")
+            return None
+
+        self.crawled_urls.add(url)
+
+        result = {
+            'title': title[:200],
+            'content': content[:3000],  # Reasonable limit
+            'url': url,
+            'domain': urlparse(url).netloc
+        }
+
+        logger.info(f"Successfully extracted content from {url}: {len(content)} chars")
+        return result
+
     def sanitize_content(self, article: Dict[str, str]) -> Dict[str, str]:
         """Remove potentially sensitive information"""
         # Remove email addresses
@@ -195,45 +177,121 @@ class SmartCrawler:
 
         return article
 
-    def crawl_for_query(self, query: str, max_articles: int = 2) -> List[Dict[str, str]]:
-        """Crawl web for query with privacy protection"""
-        logger.info(f"Starting crawl for: {self.anonymize_query(query)}")
-
-        urls = self.get_search_urls(query, num_results=max_articles * 2)
-        articles = []
-
-        for url in urls:
-            if len(articles) >= max_articles:
-                break
-
-            article = self.extract_content(url)
-            if article:
-                article = self.sanitize_content(article)
-                articles.append(article)
+    def same_site_links(self, page_url: str, hrefs: List[str]) -> List[str]:
+        """Absolute, crawlable links from a page that stay on the page's site"""
+        site = site_of(page_url)
+        links = []
+        for href in hrefs:
+            url = normalize_url(page_url, href)
+            if url and site_of(url) == site and self.is_valid_url(url):
+                links.append(url)
+        return list(dict.fromkeys(links))
+
+    def crawl_frontier(self, max_pages: int, store_batch_size: int = 10) -> int:
+        """
+        Crawl pages from the frontier, following same-site links; returns articles stored.
+        Fetching stays sequential (politeness delays); each page is parsed on the
+        extractor pool while the next one is fetched.
+        """
+        self.frontier.start_run()
+        total_added = 0
+        pages = 0
+        batch = []
+        pending = []  # (url, depth, future) pages still being parsed in the extractor pool
+        max_pending = max(1, self.extractor.workers) * 2
+
+        def flush():
+            nonlocal total_added, batch
+            if batch:
+                self.rag_system.store_documents(batch)
+                total_added += len(batch)
+                batch = []
+
+        def collect(done_only: bool):
+            for entry in list(pending):
+                url, depth, future = entry
+                if done_only and not future.done():
+                    continue
+                pending.remove(entry)
+                try:
+                    title, content, hrefs = future.result()
+                except Exception as e:
+                    logger.warning(f"Error extracting content from {url}: {e}")
+                    continue
+
+                self.frontier.record_crawl(url)
+                article = self.build_article(url, title, content)
+                if article:
+                    batch.append(self.sanitize_content(article))
+                    if len(batch) >= store_batch_size:
+                        flush()
+                if depth < self.frontier.max_depth:
+                    self.frontier.push_many(self.same_site_links(url, hrefs), depth=depth + 1)
 
-        logger.info(f"Successfully crawled {len(articles)} articles for query")
-        return articles
+        try:
+            while pages < max_pages:
+                if self.frontier.paused:
+                    logger.info("Crawl frontier paused; stopping this run.")
+                    break
+                collect(done_only=True)
+                item = self.frontier.pop()
+                if item is None:
+                    if not pending:
+                        break
+                    collect(done_only=False)  # their links may refill the frontier
+                    continue
+                url, depth = item
+                if url in self.crawled_urls or not self.is_valid_url(url):
+                    continue
+                if not self.robots.allowed(url):
+                    logger.info(f"Skipping {url}: disallowed by robots.txt")
+                    continue
+
+                # Honour a robots.txt Crawl-delay on top of the usual politeness delay, but
+                # skip hosts asking for more than we can wait without stalling the whole crawl
+                crawl_delay = self.robots.crawl_delay(url)
+                if crawl_delay > self.max_crawl_delay:
+                    logger.info(f"Skipping {url}: Crawl-delay of {crawl_delay:.0f}s exceeds {self.max_crawl_delay:.0f}s")
+                    continue
+                time.sleep(crawl_delay)
+                fetched = self.fetch_page(url)
+                pages += 1
+                if fetched is None:
+                    continue
+                html, final_url = fetched
+                if final_url != url:
+                    # Links and the article are keyed on where the page actually lives
+                    self.crawled_urls.add(url)
+                    if final_url in self.crawled_urls or not self.is_valid_url(final_url):
+                        continue
+                pending.append((final_url, depth, self.extractor.submit(html)))
+                if len(pending) >= max_pending:
+                    collect(done_only=False)
+        finally:
+            collect(done_only=False)
+            flush()
+            self.frontier.checkpoint()
+
+        logger.info(f"Frontier crawl fetched {pages} pages, {len(self.frontier)} URLs pending")
+        return total_added
 
     def run(self):
         """Main crawler entry point - with better error handling"""
         logger.info("🚀 Starting crawl to populate knowledge base...")
 
-        total_added = 0
+        # Curated topic URLs seed the frontier; discovered links are queued behind them
         for topic in self.crawl_topics:
-            try:
-                articles = self.crawl_for_query(topic, max_articles=2)
-                if articles:
-                    self.rag_system.store_documents(articles)
-                    total_added += len(articles)
-                    logger.info(f"Added {len(articles)} articles for topic: {topic}")
-                else:
-                    logger.warning(f"No articles found for topic: {topic}")
-            except Exception as e:
-                logger.error(f"Error crawling topic '{topic}': {e}")
-                continue
+            for url in self.get_search_urls(topic, num_results=3):
+                self.frontier.push_seed(url)
+
+        total_added = 0
+        try:
+            total_added = self.crawl_frontier(self.max_pages_per_run)
+        except Exception as e:
+            logger.error(f"Error crawling frontier: {e}")
 
         logger.info(f"✅ Crawl finished. Total articles added: {total_added}")
 
         # If no articles were added, log warning
-        if total_added == 0:
+        if total_added == 0 and not self.frontier.paused:
             logger.warning("No articles were successfully crawled. Check network connectivity and dependencies.")
\ No newline at end of file
@@ -0,0 +1,49 @@
+# backend/test_content_extractor.py - Parity checks: lxml extractor vs the original BeautifulSoup one
+import pytest
+
+from content_extractor import _extract_bs4, _extract_lxml
+
+FILLER = "This sentence pads the content past the selector threshold. " * 3
+
+PAGES = {
+    "comment_tail": f"<html><body><article><p>{FILLER}</p><!-- c -->tail text</article></body></html>",
+    "tail_text": f"<html><body><main><p>{FILLER}</p>between<p>after</p>end</main></body></html>",
+    "nested_section": (
+        f"<html><body><section>outer {FILLER}<section>inner {FILLER}</section>"
+        f"after inner</section></body></html>"
+    ),
+    "paragraph_fallback": "<html><body><div><p>first <b>bold</b></p><!-- x --><p>second</p></div></body></html>",
+    "body_fallback": "<html><body><p>a</p>b<p>c</p><!-- c -->d<span>e</span>f</body></html>",
+    "stripped_tail": "<html><body>before<script>var x;</script>after<aside>side</aside>end</body></html>",
+    "boilerplate": (
+        f"<html><head><title> Page </title></head><body><nav><a href='/n'>nav</a></nav>"
+        f"<article>{FILLER}<script>var x;</script>kept tail</article><footer>foot</footer></body></html>"
+    ),
+    "template": "<html><body><p>short</p><template><div>Hidden template markup</div></template>after</body></html>",
+    "template_in_main": (
+        f"<html><body><main>{FILLER}<template><p>inert {FILLER}</p></template>kept</main></body></html>"
+    ),
+    "template_role_main": f"<html><body><template role='main'>{FILLER}</template><p>visible</p></body></html>",
+    "noscript_in_script": "<html><body><div>a<script><noscript></noscript>w</script>b</div></body></html>",
+}
+
+
+@pytest.mark.parametrize("name", sorted(PAGES))
+def test_lxml_matches_bs4(name):
+    html = PAGES[name].encode("utf-8")
+    assert _extract_lxml(html) == _extract_bs4(html, "lxml")
+
+
+def test_comment_tail_is_kept():
+    _, content, _ = _extract_lxml(PAGES["comment_tail"].encode("utf-8"))
+    assert content.endswith("tail text")
+
+
+def test_body_fallback_separates_words():
+    _, content, _ = _extract_lxml(PAGES["body_fallback"].encode("utf-8"))
+    assert content == "a b c d e f"
+
+
+def test_template_text_is_dropped():
+    _, content, _ = _extract_lxml(PAGES["template"].encode("utf-8"))
+    assert content == "short after"
@@ -0,0 +1,109 @@
+# backend/test_vector_store.py - MmapVectorStore: round trip, cross-instance refresh, recovery and IVF
+import os
+
+import numpy as np
+import pytest
+
+from vector_store import MmapVectorStore
+
+DIM = 16
+
+
+def make_docs(n, start=0, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"https://example.com/{i}" for i in range(start, start + n)]
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    documents = [f"document {i}" for i in range(start, start + n)]
+    metadatas = [{"title": f"Doc {i}", "url": ids[i - start]} for i in range(start, start + n)]
+    return ids, vectors, documents, metadatas
+
+
+@pytest.fixture(params=["float16", "float32"])
+def store(request, tmp_path):
+    return MmapVectorStore(str(tmp_path / "store"), dtype=request.param)
+
+
+def test_add_query_existing_ids(store):
+    ids, vectors, documents, metadatas = make_docs(50)
+    store.add(ids, vectors, documents, metadatas)
+
+    assert store.count() == 50
+    assert store.existing_ids(ids[:3] + ["https://example.com/missing"]) == set(ids[:3])
+
+    hits = store.query(vectors[[7, 21]], n_results=3)
+    assert [h[0]["id"] for h in hits] == [ids[7], ids[21]]
+    assert hits[0][0]["document"] == "document 7"
+    assert hits[0][0]["metadata"] == metadatas[7]
+    assert hits[0][0]["distance"] == pytest.approx(0.0, abs=1e-3)
+    assert all(len(h) == 3 for h in hits)
+
+
+def test_query_empty_store(store):
+    assert store.count() == 0
+    assert store.query(np.ones((2, DIM), dtype=np.float32), n_results=5) == [[], []]
+
+
+def test_second_instance_sees_appended_rows(tmp_path):
+    path = str(tmp_path / "store")
+    writer = MmapVectorStore(path)
+    reader = MmapVectorStore(path)
+    ids, vectors, documents, metadatas = make_docs(10)
+    writer.add(ids, vectors, documents, metadatas)
+    assert reader.count() == 10
+
+    more_ids, more_vectors, more_documents, more_metadatas = make_docs(5, start=10, seed=1)
+    writer.add(more_ids, more_vectors, more_documents, more_metadatas)
+    assert reader.count() == 15
+    assert reader.existing_ids(more_ids) == set(more_ids)
+    assert reader.query(more_vectors[2], n_results=1)[0][0]["id"] == more_ids[2]
+    assert sum(len(batch[0]) for batch in reader.iter_documents(batch_size=4)) == 15
+
+
+def test_interrupted_write_is_truncated(tmp_path):
+    path = str(tmp_path / "store")
+    store = MmapVectorStore(path, dtype="float32")
+    ids, vectors, documents, metadatas = make_docs(10)
+    store.add(ids, vectors, documents, metadatas)
+
+    # A writer that died before updating header.json leaves trailing bytes behind
+    for name in ("vectors.bin", "meta.jsonl", "meta.idx"):
+        with open(os.path.join(path, name), "ab") as f:
+            f.write(b"\x01" * 37)
+
+    more = make_docs(3, start=10, seed=2)
+    store.add(*more)
+    reopened = MmapVectorStore(path, dtype="float32")
+    assert reopened.count() == 13
+    assert reopened.query(more[1][1], n_results=1)[0][0]["id"] == more[0][1]
+    assert reopened.query(vectors[4], n_results=1)[0][0]["id"] == ids[4]
+
+
+def test_ivf_matches_exact_scan(tmp_path):
+    # Clustered data, so probing the nearest lists finds the true neighbours
+    rng = np.random.default_rng(3)
+    centers = rng.standard_normal((8, DIM)).astype(np.float32) * 5
+    vectors = (centers[rng.integers(0, 8, 2000)] + rng.standard_normal((2000, DIM))).astype(np.float32)
+    ids = [f"doc-{i}" for i in range(2000)]
+    documents = ids
+    metadatas = [{} for _ in ids]
+    queries = (centers[rng.integers(0, 8, 20)] + rng.standard_normal((20, DIM))).astype(np.float32)
+
+    exact = MmapVectorStore(str(tmp_path / "exact"), dtype="float32")
+    exact.add(ids, vectors, documents, metadatas)
+    indexed = MmapVectorStore(str(tmp_path / "ivf"), dtype="float32", ivf_nprobe=4)
+    indexed.add(ids, vectors, documents, metadatas)
+    indexed.build_ivf(n_lists=16)
+
+    expected = [[h["id"] for h in hits] for hits in exact.query(queries, n_results=5)]
+    found = [[h["id"] for h in hits] for hits in indexed.query(queries, n_results=5)]
+    recall = np.mean([len(set(e) & set(f)) / 5 for e, f in zip(expected, found)])
+    assert recall >= 0.9
+
+    # Probing every list is an exact scan
+    indexed.ivf_nprobe = 16
+    assert [[h["id"] for h in hits] for hits in indexed.query(queries, n_results=5)] == expected
+
+    # Rows added after the build are still found
+    new_ids, new_vectors, new_documents, new_metadatas = make_docs(3, seed=4)
+    indexed.add(new_ids, new_vectors * 10, new_documents, new_metadatas)
+    assert indexed.query(new_vectors[0], n_results=1)[0][0]["id"] == new_ids[0]
@@ -0,0 +1,515 @@
+# backend/vector_store.py - Pluggable vector store backends used by PrivacyRAGSystem
+import os
+import json
+import mmap
+import math
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Set, Iterator, Tuple
+
+import numpy as np
+
+try:
+    import fcntl  # POSIX only; used to serialise writers across worker processes
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore:
+    """
+    The small surface PrivacyRAGSystem needs from a vector store.
+    query() returns one list of hits per query embedding; each hit is a dict
+    with 'id', 'document', 'metadata' and 'distance' (lower is closer).
+    """
+    storage_type = "unknown"
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        raise NotImplementedError
+
+    def add(self, ids: List[str], embeddings, documents: List[str], metadatas: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def iter_documents(self, batch_size: int = 256) -> Iterator[Tuple[List[str], List[str], List[Dict[str, Any]]]]:
+        """Yields (ids, documents, metadatas) batches covering every stored document."""
+        raise NotImplementedError
+
+    def drop(self):
+        """Deletes the underlying collection and its data."""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases processes or handles held by the store."""
+        pass
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    Vector store backed by a chromadb PersistentClient collection.
+
+    New collections use cosine space so distances mean 1 - cosine similarity, as
+    in MmapVectorStore. Collections created before that keep chroma's default L2
+    space (the HNSW space cannot be changed in place); re-embed to migrate them.
+    """
+    storage_type = "local_chroma_db"
+
+    def __init__(self, path: str, collection_name: str = "documents"):
+        import chromadb
+        self.client = chromadb.PersistentClient(path=path)
+        try:
+            self.collection = self.client.get_collection(name=collection_name)
+        except ValueError:  # chromadb raises ValueError for a missing collection
+            self.collection = self.client.create_collection(
+                name=collection_name, metadata={"hnsw:space": "cosine"}
+            )
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        if space != "cosine":
+            logger.warning(f"Chroma collection '{collection_name}' uses {space} distance; "
+                           f"scores are not comparable with the mmap backend until it is re-embedded")
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        if not ids:
+            return set()
+        # Chroma rejects a get() with repeated ids, so one duplicate URL would fail the batch
+        return set(self.collection.get(ids=list(dict.fromkeys(ids)), include=[])['ids'])
+
+    def add(self, ids, embeddings, documents, metadatas):
+        if hasattr(embeddings, 'tolist'):
+            embeddings = embeddings.tolist()
+        self.collection.add(embeddings=embeddings, documents=documents, metadatas=metadatas, ids=ids)
+
+    def query(self, query_embeddings, n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        if hasattr(query_embeddings, 'tolist'):
+            query_embeddings = query_embeddings.tolist()
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=['documents', 'metadatas', 'distances']
+        )
+        hits = []
+        for q in range(len(query_embeddings)):
+            per_query = []
+            if results and results['documents']:
+                for i in range(len(results['documents'][q])):
+                    per_query.append({
+                        "id": results['ids'][q][i],
+                        "document": results['documents'][q][i],
+                        "metadata": results['metadatas'][q][i] or {},
+                        "distance": results['distances'][q][i]
+                    })
+            hits.append(per_query)
+        return hits
+
+    def iter_documents(self, batch_size: int = 256):
+        offset = 0
+        while True:
+            batch = self.collection.get(limit=batch_size, offset=offset, include=['documents', 'metadatas'])
+            if not batch['ids']:
+                return
+            yield batch['ids'], batch['documents'], [m or {} for m in batch['metadatas']]
+            offset += len(batch['ids'])
+
+    def drop(self):
+        self.client.delete_collection(self.collection.name)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _MappedView:
+    """
+    The mapped files as of one header. Refreshes build a new view instead of
+    mutating this one, so a query can keep scanning its snapshot without a lock.
+    """
+    __slots__ = ("header", "vectors", "offsets", "meta_map", "ivf")
+
+    def __init__(self, header: Dict[str, Any]):
+        self.header = header
+        self.vectors = None
+        self.offsets = None
+        self.meta_map = None
+        self.ivf = None
+
+    @property
+    def count(self) -> int:
+        return self.header["count"]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        start, length = (int(v) for v in self.offsets[row])
+        return json.loads(self.meta_map[start:start + length])
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Append-only store keeping L2-normalised embeddings in a memory-mapped NumPy file.
+
+    Layout of the store directory:
+      header.json  - dim, dtype, row count and IVF state (rewritten atomically)
+      vectors.bin  - row-major float16/float32 matrix of shape (count, dim)
+      meta.jsonl   - one JSON record per row: id, document, metadata
+      meta.idx     - uint64 (offset, length) pairs locating each record in meta.jsonl
+      ivf_*.npy    - optional IVF centroids, list offsets and row order
+
+    Files are opened read-only with mmap, so several worker processes serving the
+    same directory share the page cache instead of each holding a private index.
+    Similarity is cosine; distance is reported as 1 - cosine similarity.
+    """
+    storage_type = "local_mmap"
+    # Rows widened to float32 at a time while scanning: ~6 MB of scratch at 384 dims
+    BLOCK_ROWS = 4096
+
+    def __init__(self, path: str, dtype: str = "float16", ivf_nprobe: int = 8, ivf_threshold: int = 0):
+        if dtype not in ("float16", "float32"):
+            raise ValueError(f"Unsupported dtype for MmapVectorStore: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf_threshold = ivf_threshold
+        self._header_path = os.path.join(path, "header.json")
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._meta_path = os.path.join(path, "meta.jsonl")
+        self._offsets_path = os.path.join(path, "meta.idx")
+        self._lock_path = os.path.join(path, ".lock")
+        self._lock = threading.RLock()
+
+        self._header = self._read_header() or {"dim": None, "dtype": dtype, "count": 0, "ivf_count": 0}
+        self._header_mtime = None
+        self._view = _MappedView(self._header)
+        self._id_to_row: Optional[Dict[str, int]] = None
+        self._refresh(force=True)
+
+    # --- Header and mapping management ---
+
+    def _read_header(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._header_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_header(self, header: Dict[str, Any]):
+        tmp_path = self._header_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self._header_path)
+
+    @contextmanager
+    def _writer_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self, force: bool = False):
+        """Re-map the data files if another process (or this one) appended rows."""
+        try:
+            stat = os.stat(self._header_path)
+            mtime = (stat.st_mtime_ns, stat.st_ino)  # os.replace() gives every header a new inode
+        except FileNotFoundError:
+            mtime = None
+        if not force and mtime == self._header_mtime:
+            return
+
+        with self._lock:
+            header = self._read_header() or self._header
+            count, dim = header["count"], header["dim"]
+            # Old maps are not closed here: in-flight queries may still hold the previous
+            # view, and its mappings are released once the last reference goes away.
+            view = _MappedView(header)
+            if count > 0:
+                view.vectors = np.memmap(self._vectors_path, dtype=header["dtype"], mode="r", shape=(count, dim))
+                view.offsets = np.memmap(self._offsets_path, dtype=np.uint64, mode="r", shape=(count, 2))
+                with open(self._meta_path, "rb") as f:
+                    view.meta_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if header.get("ivf_count", 0) > 0:
+                    view.ivf = {
+                        "centroids": np.load(os.path.join(self.path, "ivf_centroids.npy")),
+                        "offsets": np.load(os.path.join(self.path, "ivf_offsets.npy")),
+                        "order": np.load(os.path.join(self.path, "ivf_order.npy"), mmap_mode="r"),
+                        "count": header["ivf_count"]
+                    }
+            if self._id_to_row is not None and count < len(self._id_to_row):
+                self._id_to_row = None  # store was rebuilt underneath us
+            self._view = view
+            self._header = header
+            self._header_mtime = mtime
+
+    def _load_id_index(self) -> Dict[str, int]:
+        """Builds the id -> row map lazily; only ingest paths need it."""
+        if self._id_to_row is None:
+            self._id_to_row = {self._view.record(row)["id"]: row for row in range(self._header["count"])}
+        elif len(self._id_to_row) < self._header["count"]:
+            for row in range(len(self._id_to_row), self._header["count"]):
+                self._id_to_row[self._view.record(row)["id"]] = row
+        return self._id_to_row
+
+    # --- VectorStore interface ---
+
+    def count(self) -> int:
+        self._refresh()
+        return self._header["count"]
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        self._refresh()
+        with self._lock:
+            id_index = self._load_id_index()
+            return {doc_id for doc_id in ids if doc_id in id_index}
+
+    def add(self, ids, embeddings, documents, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(vectors) != len(ids):
+            raise ValueError("Number of embeddings does not match number of ids.")
+        vectors = _normalize(vectors)
+
+        with self._writer_lock():
+            self._refresh(force=True)
+            header = dict(self._header)
+            if header["dim"] is None:
+                header["dim"] = int(vectors.shape[1])
+            elif header["dim"] != vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {header['dim']}.")
+
+            count = header["count"]
+            itemsize = np.dtype(header["dtype"]).itemsize
+            meta_end = int(self._view.offsets[-1].sum()) if count > 0 else 0
+
+            # Truncate to the committed sizes first so a previously interrupted write
+            # can never shift row numbering.
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(count * header["dim"] * itemsize)
+                f.write(vectors.astype(header["dtype"]).tobytes())
+
+            offsets = np.empty((len(ids), 2), dtype=np.uint64)
+            with open(self._meta_path, "ab") as f:
+                f.truncate(meta_end)
+                position = meta_end
+                for i, (doc_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+                    line = json.dumps({"id": doc_id, "document": document, "metadata": metadata}).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offsets[i] = (position, len(line))
+                    position += len(line)
+
+            with open(self._offsets_path, "ab") as f:
+                f.truncate(count * 2 * 8)
+                f.write(offsets.tobytes())
+
+            header["count"] = count + len(ids)
+            self._write_header(header)
+            self._refresh(force=True)
+            if self._id_to_row is not None:
+                for i, doc_id in enumerate(ids):
+                    self._id_to_row[doc_id] = count + i
+
+        if self.ivf_threshold and header["count"] >= self.ivf_threshold:
+            unindexed = header["count"] - header.get("ivf_count", 0)
+            if unindexed > header["count"] * 0.1:
+                self.build_ivf()
+
+    def query(self, query_embeddings, n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        self._refresh()
+
+        # Scan a snapshot without holding the lock, so concurrent searches run in parallel
+        view = self._view
+        count = view.count
+        if count == 0 or n_results <= 0:
+            return [[] for _ in range(len(queries))]
+        queries = _normalize(queries)
+        k = min(n_results, count)
+
+        if view.ivf is not None:
+            per_query = [self._ivf_search(view, queries[i], k) for i in range(len(queries))]
+        else:
+            rows, sims = self._top_k(view, queries, k)
+            per_query = list(zip(rows, sims))
+
+        results = []
+        for rows, sims in per_query:
+            hits = []
+            for row, sim in zip(rows, sims):
+                record = view.record(int(row))
+                hits.append({
+                    "id": record["id"],
+                    "document": record["document"],
+                    "metadata": record.get("metadata") or {},
+                    "distance": float(1.0 - sim)
+                })
+            results.append(hits)
+        return results
+
+    def iter_documents(self, batch_size: int = 256):
+        row = 0
+        while True:
+            self._refresh()
+            view = self._view
+            end = min(row + batch_size, view.count)
+            if row >= end:
+                return
+            records = [view.record(r) for r in range(row, end)]
+            yield ([r["id"] for r in records], [r["document"] for r in records],
+                   [r.get("metadata") or {} for r in records])
+            row = end
+
+    def drop(self):
+        with self._writer_lock():
+            self._header = {"dim": None, "dtype": self._header["dtype"], "count": 0, "ivf_count": 0}
+            self._view = _MappedView(self._header)
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    # --- Search internals ---
+
+    def _top_k(self, view: _MappedView, queries: np.ndarray, k: int, candidates: Optional[np.ndarray] = None):
+        """Exact top-k by dot product, scanning in blocks to bound float32 temporaries."""
+        total = len(candidates) if candidates is not None else view.count
+        best_sims = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        # float16 rows are widened into one reused buffer rather than a new array per block
+        scratch = None
+        if view.vectors.dtype != np.float32:
+            scratch = np.empty((min(self.BLOCK_ROWS, total), view.vectors.shape[1]), dtype=np.float32)
+
+        for start in range(0, total, self.BLOCK_ROWS):
+            end = min(start + self.BLOCK_ROWS, total)
+            if candidates is None:
+                block_rows = np.arange(start, end, dtype=np.int64)
+                block = view.vectors[start:end]
+            else:
+                block_rows = candidates[start:end]
+                block = view.vectors[block_rows]
+            if scratch is not None:
+                np.copyto(scratch[:end - start], block)
+                block = scratch[:end - start]
+            sims = queries @ block.T
+
+            cand_sims = np.concatenate([best_sims, sims], axis=1)
+            cand_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, sims.shape)], axis=1)
+            if cand_sims.shape[1] > k:
+                keep = np.argpartition(-cand_sims, k - 1, axis=1)[:, :k]
+                cand_sims = np.take_along_axis(cand_sims, keep, axis=1)
+                cand_rows = np.take_along_axis(cand_rows, keep, axis=1)
+            best_sims, best_rows = cand_sims, cand_rows
+
+        order = np.argsort(-best_sims, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_sims, order, axis=1)
+
+    def _ivf_search(self, view: _MappedView, query: np.ndarray, k: int):
+        ivf = view.ivf
+        nprobe = min(self.ivf_nprobe, len(ivf["centroids"]))
+        centroid_sims = ivf["centroids"] @ query
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]
+
+        parts = [np.asarray(ivf["order"][ivf["offsets"][c]:ivf["offsets"][c + 1]]) for c in probe]
+        # Rows appended after the last IVF build are always scanned exactly.
+        parts.append(np.arange(ivf["count"], view.count, dtype=np.int64))
+        candidates = np.sort(np.concatenate(parts).astype(np.int64))
+        if len(candidates) == 0:
+            return [], []
+        rows, sims = self._top_k(view, query.reshape(1, -1), min(k, len(candidates)), candidates)
+        return rows[0], sims[0]
+
+    def build_ivf(self, n_lists: Optional[int] = None, iterations: int = 10, sample_size: int = 20000, seed: int = 0):
+        """
+        Partitions the stored vectors with spherical k-means so queries only scan
+        the `ivf_nprobe` closest lists. Useful once the corpus is large enough that
+        an exact scan dominates query latency.
+        """
+        with self._writer_lock():
+            self._refresh(force=True)
+            count = self._header["count"]
+            if count == 0:
+                return
+            n_lists = n_lists or max(1, int(math.sqrt(count)))
+            n_lists = min(n_lists, count)
+            rng = np.random.default_rng(seed)
+
+            sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+            vectors = self._view.vectors
+            sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[assignment == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            assignment = np.empty(count, dtype=np.int64)
+            for start in range(0, count, self.BLOCK_ROWS):
+                end = min(start + self.BLOCK_ROWS, count)
+                block = np.asarray(vectors[start:end], dtype=np.float32)
+                assignment[start:end] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+
+            for name, array in (("ivf_centroids.npy", centroids.astype(np.float32)),
+                                ("ivf_offsets.npy", offsets.astype(np.int64)),
+                                ("ivf_order.npy", order.astype(np.int64))):
+                tmp_path = os.path.join(self.path, name + ".tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, os.path.join(self.path, name))
+
+            header = dict(self._header)
+            header["ivf_count"] = count
+            self._write_header(header)
+            self._refresh(force=True)
+        logger.info(f"Built IVF index over {count} vectors with {n_lists} lists.")
+
+
+def create_vector_store(kind: str, base_dir: str, collection_name: str = "documents") -> VectorStore:
+    """
+    Builds the vector store selected by `kind` ('chroma' or 'mmap') under base_dir.
+    With VECTOR_STORE_SHARDS > 1 the collection is split across that many local shard
+    processes (see shards.ShardedVectorStore), routed by SHARD_BY ('url' or 'domain').
+    """
+    n_shards = int(os.getenv("VECTOR_STORE_SHARDS", 1))
+    if n_shards > 1:
+        from shards import ShardedVectorStore
+        return ShardedVectorStore(
+            (kind or "chroma").lower(), base_dir, collection_name, n_shards,
+            strategy=os.getenv("SHARD_BY", "url"),
+            timeout=float(os.getenv("SHARD_TIMEOUT_SECONDS", 2.0)),
+            startup_timeout=float(os.getenv("SHARD_STARTUP_TIMEOUT_SECONDS", 120))
+        )
+    return create_single_vector_store(kind, base_dir, collection_name=collection_name)
+
+
+def create_single_vector_store(kind: str, base_dir: str, collection_name: str = "documents") -> VectorStore:
+    """Builds one unsharded store; also used inside each shard process."""
+    kind = (kind or "chroma").lower()
+    if kind == "chroma":
+        return ChromaVectorStore(os.path.join(base_dir, "chroma_db"), collection_name=collection_name)
+    if kind == "mmap":
+        return MmapVectorStore(
+            os.path.join(base_dir, "mmap_store", collection_name),
+            dtype=os.getenv("MMAP_STORE_DTYPE", "float16"),
+            ivf_nprobe=int(os.getenv("MMAP_STORE_IVF_NPROBE", 8)),
+            ivf_threshold=int(os.getenv("MMAP_STORE_IVF_THRESHOLD", 0))
+        )
+    raise ValueError(f"Unknown vector store backend: {kind}")